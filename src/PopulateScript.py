@@ -1,256 +1,311 @@
 import hashlib as h
+import logging
+import os
 import sqlite3 as sql
-import pandas as pd
+import sys
 
-def populate():
+from time import perf_counter
 
-    connection = sql.connect('database.db')
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-    with open('createTables.sql') as sql_file:
-        sql_as_string = sql_file.read()
-        connection.executescript(sql_as_string)
+from database import DATABASE_PATH
+from migrations import LATEST_VERSION, migrate
+from passwords import md4_hexdigest
 
-    students_data = pd.read_csv('Students_TA.csv')
-    professors_data = pd.read_csv('Professors.csv')
-    post_data = pd.read_csv("Posts_Comments.csv")
+# Progress goes to logging, since gunicorn.conf.py populates from inside the server. Run as a script, it is printed.
+log = logging.getLogger(__name__)
 
-    # Student File Extraction
+# The schema version a current database is at, stored in its PRAGMA user_version. See migrations.py.
+SCHEMA_VERSION = LATEST_VERSION
 
-    for col, row in students_data.iterrows():
+# Files whose contents decide what populate() writes. Their hashes are kept in the Metadata table.
+# The schema is always read from here, the CSVs from the directory populate() is given, which is kept in Metadata
+# under SOURCE_KEY so the database is later checked against that same directory.
+SCHEMA_FILE = 'createTables.sql'
+CSV_FILES = ('Students_TA.csv', 'Professors.csv', 'Posts_Comments.csv')
+SOURCE_KEY = 'source'
 
-        name = row['Full Name']
-        email = row['Email']
-        age = int(row['Age'])
-        zip_code = int(row['Zip'])
-        phone = int(row['Phone'])
-        gender = row['Gender']
-        city = row['City']
-        state = row['State']
-        hashed_password = h.new('md4', row['Password'].encode()).hexdigest()
-        street = row['Street']
-        major = row['Major']
+# Each student row carries up to three courses in wide "Course N ..." columns.
+# These map the wide column names onto the long course_rows columns for a given N.
+COURSE_SLOTS = (1, 2, 3)
 
-        #############################################################################################################################################################
 
-        # Adds zip codes into database
-        connection.execute('INSERT or IGNORE INTO Zipcodes (zipcode, city, state) VALUES (?,?,?);', (zip_code, city, state))
-        connection.commit()
+def course_columns(n):
+    return {
+        'Courses %d' % n: 'course_id',
+        'Course %d Name' % n: 'course_name',
+        'Course %d Details' % n: 'course_desc',
+        'Course %d Section' % n: 'sec_no',
+        'Course %d Section Limit' % n: 'max_limit',
+        'Course %d HW_No' % n: 'hw_no',
+        'Course %d HW_Details' % n: 'hw_details',
+        'Course %d HW_Grade' % n: 'hw_grade',
+        'Course %d EXAM_No' % n: 'exam_no',
+        'Course %d Exam_Details' % n: 'exam_details',
+        'Course %d EXAM_Grade' % n: 'exam_grade',
+    }
 
-        #############################################################################################################################################################
 
-        # Adds students into User Database and Student database
-        connection.execute(
-            'INSERT or IGNORE INTO User (email, password_hashed, name, age, gender) VALUES (?,?,?,?,?);',
-            (email, hashed_password, name, age, gender))
-        connection.commit()
+# The seed passwords are stored as legacy MD4 digests, which keeps populating fast. Each is upgraded to the configured
+# hasher the first time its user logs in (see passwords.py).
+def hash_password(password):
+    return md4_hexdigest(password.encode())
 
-        connection.execute(
-            'INSERT or IGNORE INTO Students (email, phone, major, zipcode) VALUES (?,?,?,?);',
-            (email, phone, major, zip_code))
-        connection.commit()
 
-        #############################################################################################################################################################
+# Converts a DataFrame into a list of plain python tuples for executemany, with NaN turned into NULL.
+def to_rows(frame):
+    frame = frame.astype(object)
+    return list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
 
-        # Adds Course into database
-        connection.execute('INSERT or IGNORE INTO Courses (course_id, course_name, course_desc) VALUES (?,?,?);',
-                        (row['Courses 1'], row['Course 1 Name'], row['Course 1 Details']))
-        connection.commit()
 
-        connection.execute('INSERT or IGNORE INTO Courses (course_id, course_name, course_desc) VALUES (?,?,?);',
-                        (row['Courses 2'], row['Course 2 Name'], row['Course 2 Details']))
-        connection.commit()
-
-        connection.execute('INSERT or IGNORE INTO Courses (course_id, course_name, course_desc) VALUES (?,?,?);',
-                        (row['Courses 3'], row['Course 3 Name'], row['Course 3 Details']))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Section into database
-
-        connection.execute('INSERT or IGNORE INTO Sections (course_id, sec_no, max_limit) VALUES (?,?,?);',
-                        (row['Courses 1'], row['Course 1 Section'], row['Course 1 Section Limit']))
-        connection.commit()
-
-        connection.execute('INSERT or IGNORE INTO Sections (course_id, sec_no, max_limit) VALUES (?,?,?);',
-                        (row['Courses 2'], row['Course 2 Section'], row['Course 2 Section Limit']))
-        connection.commit()
-
-        connection.execute('INSERT or IGNORE INTO Sections (course_id, sec_no, max_limit) VALUES (?,?,?);',
-                        (row['Courses 3'], row['Course 3 Section'], row['Course 3 Section Limit']))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Enrolled data to database
-        connection.execute('INSERT or IGNORE INTO Enrolls (student_email, course_id, section_no) VALUES (?,?,?)',
-                        (email, row['Courses 1'], row['Course 1 Section']))
-        connection.commit()
-
-        connection.execute('INSERT or IGNORE INTO Enrolls (student_email, course_id, section_no) VALUES (?,?,?)',
-                        (email, row['Courses 2'], row['Course 2 Section']))
-        connection.commit()
-
-        connection.execute('INSERT or IGNORE INTO Enrolls (student_email, course_id, section_no) VALUES (?,?,?)',
-                        (email, row['Courses 3'], row['Course 3 Section']))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Homework data to database
-        if not (str(row['Course 1 HW_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Homework (course_id, sec_no, hw_no, hw_details) VALUES (?,?,?,?);', (
-                row['Courses 1'], row['Course 1 Section'], row['Course 1 HW_No'], row['Course 1 HW_Details']))
-            connection.commit()
-
-        if not (str(row['Course 2 HW_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Homework (course_id, sec_no, hw_no, hw_details) VALUES (?,?,?,?);', (
-                row['Courses 2'], row['Course 2 Section'], row['Course 2 HW_No'], row['Course 2 HW_Details']))
-            connection.commit()
-
-        if not (str(row['Course 3 HW_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Homework (course_id, sec_no, hw_no, hw_details) VALUES (?,?,?,?);', (
-                row['Courses 3'], row['Course 3 Section'], row['Course 3 HW_No'], row['Course 3 HW_Details']))
-            connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Exams data to database
-        if not (str(row['Course 1 EXAM_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Exams (course_id, sec_no, exam_no, exam_details) VALUES (?,?,?,?);', (
-                row['Courses 1'], row['Course 1 Section'], row['Course 1 EXAM_No'], row['Course 1 Exam_Details']))
-            connection.commit()
-
-        if not (str(row['Course 2 EXAM_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Exams (course_id, sec_no, exam_no, exam_details) VALUES (?,?,?,?);', (
-                row['Courses 2'], row['Course 2 Section'], row['Course 2 EXAM_No'], row['Course 2 Exam_Details']))
-            connection.commit()
-
-        if not (str(row['Course 3 EXAM_No']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO Exams (course_id, sec_no, exam_no, exam_details) VALUES (?,?,?,?);', (
-                row['Courses 3'], row['Course 3 Section'], row['Course 3 EXAM_No'], row['Course 3 Exam_Details']))
-            connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Homework grades data to database
-        if not (str(row['Course 1 HW_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 1'], row['Course 1 Section'], row['Course 1 HW_No'], row['Course 1 HW_Grade']))
-            connection.commit()
-
-        if not (str(row['Course 2 HW_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 2'], row['Course 2 Section'], row['Course 2 HW_No'], row['Course 2 HW_Grade']))
-            connection.commit()
-
-        if not (str(row['Course 3 HW_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 3'], row['Course 3 Section'], row['Course 3 HW_No'], row['Course 3 HW_Grade']))
-            connection.commit()
-
-        #############################################################################################################################################################
-
-        # Adds Exam grades data to database
-        if not (str(row['Course 1 EXAM_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 1'], row['Course 1 Section'], row['Course 1 EXAM_No'], row['Course 1 EXAM_Grade']))
-            connection.commit()
-
-        if not (str(row['Course 2 EXAM_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 2'], row['Course 2 Section'], row['Course 2 EXAM_No'], row['Course 2 EXAM_Grade']))
-            connection.commit()
-
-        if not (str(row['Course 3 EXAM_No']) == 'nan'):
-            connection.execute(
-                'INSERT or IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?);',
-                (email, row['Courses 3'], row['Course 3 Section'], row['Course 3 EXAM_No'], row['Course 3 EXAM_Grade']))
-            connection.commit()
-
-        # They are apart of a teaching team
-        if not (str(row['Teaching Team ID']) == 'nan'):
-            connection.execute('INSERT or IGNORE INTO TA_Teaching_Teams (student_email, teaching_team_id) VALUES (?,?)',
-                            (email, row['Teaching Team ID']))
-            connection.commit()
-
-    # Professor File Extraction
-
-    for col, row in professors_data.iterrows():
-        email = row['Email']
-        hashed_password = h.new('md4', row['Password'].encode()).hexdigest()
-        name = row['Name']
-        age = int(row['Age'])
-        gender = row['Gender']
-        d_id = row['Department']
-        office = row['Office']
-        dname = row['Department Name']
-        title = row['Title']
-        t_id = int(row['Teaching Team ID'])
-
-        connection.execute(
-            'INSERT or IGNORE INTO User (email, password_hashed, name, age, gender) VALUES (?,?,?,?,?);',
-            (email, hashed_password, name, age, gender))
-        connection.commit()
-
-        connection.execute(
-            'INSERT or IGNORE INTO Professors (email, office_address, department, title) VALUES (?,?,?,?);',
-            (email, office, d_id, title))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        connection.execute('INSERT or IGNORE INTO Prof_Teaching_Teams (prof_email, teaching_team_id) VALUES (?,?);',
-                        (email, t_id))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        if title == "Head":
-            connection.execute('INSERT or IGNORE INTO Departments (dept_id, dept_name, dept_head) VALUES (?,?,?);',
-                            (d_id, dname, email))
-            connection.commit()
-
-        #############################################################################################################################################################
-
-        connection.execute('UPDATE Courses SET teaching_team_id = ? WHERE course_id = ?', (t_id, row['Teaching']))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-    # Post_Comment Processing
-    for col, row in post_data.iterrows():
-
-        first = 1
-        first1 = 1
-
-        # Update course drop deadline
-        connection.execute('UPDATE Courses SET late_drop_deadline = ? WHERE course_id = ?',
-                        (row['Drop Deadline'], row['Courses']))
-        connection.commit()
-
-        #############################################################################################################################################################
-
-        if str(row['Post 1 By']) != 'nan':
-            connection.execute(
-                'INSERT or IGNORE INTO Posts (course_id, post_no, student_email, post_content) VALUES (?,?,?,?);',
-                (row['Courses'], 1, row['Post 1 By'], row['Post 1']))
-            connection.commit()
-
-        #############################################################################################################################################################
-
-        if str(row['Comment 1 By']) != 'nan':
-            connection.execute(
-                'INSERT or IGNORE INTO Comments (course_id, post_no, comment_no, student_email, comment_content) VALUES (?,?,?,?,?);',
-                (row['Courses'], 1, 1, row['Comment 1 By'], row['Comment 1']))
-            connection.commit()
+# Runs one statement for every row inside a single transaction and reports the load rate.
+def load_table(connection, label, statement, rows):
+    start = perf_counter()
+    with connection:
+        connection.executemany(statement, rows)
+    elapsed = perf_counter() - start
+
+    rate = len(rows) / elapsed if elapsed else float('inf')
+    log.info("%-20s %7d rows in %6.3fs (%.0f rows/sec)", label, len(rows), elapsed, rate)
+    return label, len(rows), elapsed
+
+
+# Melts the three wide course slots of the student file into one long table, one row per student per course.
+# Rows stay in file order (student, then slot) so INSERT OR IGNORE keeps the same first occurrence as before.
+def melt_courses(students_data):
+    import pandas as pd
+
+    slots = []
+    for n in COURSE_SLOTS:
+        columns = course_columns(n)
+        slot = students_data[['Email'] + list(columns)].rename(columns=columns)
+        slot.insert(0, 'slot', n)
+        slots.append(slot.reset_index())
+
+    course_rows = pd.concat(slots, ignore_index=True)
+    course_rows = course_rows.sort_values(['index', 'slot'], kind='stable')
+    return course_rows[course_rows['course_id'].notna()]
+
+
+# Loads the CSVs in source into the database at path. benchmarks.py scale-data writes larger CSVs of the same shape.
+def populate(path=None, source='.'):
+
+    connection = sql.connect(path or DATABASE_PATH)
+
+    migrate(connection)
+
+    # pandas is slow to import, so only populating loads it.
+    import pandas as pd
+
+    students_data = pd.read_csv(os.path.join(source, 'Students_TA.csv'))
+    professors_data = pd.read_csv(os.path.join(source, 'Professors.csv'))
+    post_data = pd.read_csv(os.path.join(source, "Posts_Comments.csv"))
+
+    #############################################################################################################################################################
+
+    # Normalize the student file.
+    students_data['Password'] = students_data['Password'].map(hash_password)
+    students_data[['Age', 'Zip', 'Phone']] = students_data[['Age', 'Zip', 'Phone']].astype('int64')
+
+    course_rows = melt_courses(students_data)
+    homework_rows = course_rows[course_rows['hw_no'].notna()]
+    exam_rows = course_rows[course_rows['exam_no'].notna()]
+    ta_rows = students_data[students_data['Teaching Team ID'].notna()]
+
+    # Normalize the professor file.
+    professors_data['Password'] = professors_data['Password'].map(hash_password)
+    professors_data[['Age', 'Teaching Team ID']] = professors_data[['Age', 'Teaching Team ID']].astype('int64')
+
+    users = pd.concat([
+        students_data[['Email', 'Password', 'Full Name', 'Age', 'Gender']].set_axis(
+            ['email', 'password_hashed', 'name', 'age', 'gender'], axis=1),
+        professors_data[['Email', 'Password', 'Name', 'Age', 'Gender']].set_axis(
+            ['email', 'password_hashed', 'name', 'age', 'gender'], axis=1),
+    ])
+
+    # Normalize the post and comment file.
+    posts = post_data[post_data['Post 1 By'].notna()]
+    comments = post_data[post_data['Comment 1 By'].notna()]
+
+    #############################################################################################################################################################
+
+    stats = [
+        load_table(connection, 'Zipcodes',
+                   'INSERT or IGNORE INTO Zipcodes (zipcode, city, state) VALUES (?,?,?);',
+                   to_rows(students_data[['Zip', 'City', 'State']])),
+
+        load_table(connection, 'User',
+                   'INSERT or IGNORE INTO User (email, password_hashed, name, age, gender) VALUES (?,?,?,?,?);',
+                   to_rows(users)),
+
+        load_table(connection, 'Students',
+                   'INSERT or IGNORE INTO Students (email, phone, major, zipcode) VALUES (?,?,?,?);',
+                   to_rows(students_data[['Email', 'Phone', 'Major', 'Zip']])),
+
+        load_table(connection, 'Courses',
+                   'INSERT or IGNORE INTO Courses (course_id, course_name, course_desc) VALUES (?,?,?);',
+                   to_rows(course_rows[['course_id', 'course_name', 'course_desc']])),
+
+        load_table(connection, 'Sections',
+                   'INSERT or IGNORE INTO Sections (course_id, sec_no, max_limit) VALUES (?,?,?);',
+                   to_rows(course_rows[['course_id', 'sec_no', 'max_limit']])),
+
+        load_table(connection, 'Enrolls',
+                   'INSERT or IGNORE INTO Enrolls (student_email, course_id, section_no) VALUES (?,?,?)',
+                   to_rows(course_rows[['Email', 'course_id', 'sec_no']])),
+
+        load_table(connection, 'Homework',
+                   'INSERT or IGNORE INTO Homework (course_id, sec_no, hw_no, hw_details) VALUES (?,?,?,?);',
+                   to_rows(homework_rows[['course_id', 'sec_no', 'hw_no', 'hw_details']])),
+
+        load_table(connection, 'Exams',
+                   'INSERT or IGNORE INTO Exams (course_id, sec_no, exam_no, exam_details) VALUES (?,?,?,?);',
+                   to_rows(exam_rows[['course_id', 'sec_no', 'exam_no', 'exam_details']])),
+
+        load_table(connection, 'Homework_Grades',
+                   'INSERT or IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?);',
+                   to_rows(homework_rows[['Email', 'course_id', 'sec_no', 'hw_no', 'hw_grade']])),
+
+        load_table(connection, 'Exam_Grades',
+                   'INSERT or IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?);',
+                   to_rows(exam_rows[['Email', 'course_id', 'sec_no', 'exam_no', 'exam_grade']])),
+
+        load_table(connection, 'TA_Teaching_Teams',
+                   'INSERT or IGNORE INTO TA_Teaching_Teams (student_email, teaching_team_id) VALUES (?,?)',
+                   to_rows(ta_rows[['Email', 'Teaching Team ID']])),
+
+        load_table(connection, 'Professors',
+                   'INSERT or IGNORE INTO Professors (email, office_address, department, title) VALUES (?,?,?,?);',
+                   to_rows(professors_data[['Email', 'Office', 'Department', 'Title']])),
+
+        load_table(connection, 'Prof_Teaching_Teams',
+                   'INSERT or IGNORE INTO Prof_Teaching_Teams (prof_email, teaching_team_id) VALUES (?,?);',
+                   to_rows(professors_data[['Email', 'Teaching Team ID']])),
+
+        load_table(connection, 'Departments',
+                   'INSERT or IGNORE INTO Departments (dept_id, dept_name, dept_head) VALUES (?,?,?);',
+                   to_rows(professors_data[professors_data['Title'] == 'Head'][
+                       ['Department', 'Department Name', 'Email']])),
+
+        load_table(connection, 'Courses (teams)',
+                   'UPDATE Courses SET teaching_team_id = ? WHERE course_id = ?',
+                   to_rows(professors_data[['Teaching Team ID', 'Teaching']])),
+
+        load_table(connection, 'Courses (deadlines)',
+                   'UPDATE Courses SET late_drop_deadline = ? WHERE course_id = ?',
+                   to_rows(post_data[['Drop Deadline', 'Courses']])),
+
+        load_table(connection, 'Posts',
+                   'INSERT or IGNORE INTO Posts (course_id, post_no, student_email, post_content) VALUES (?,1,?,?);',
+                   to_rows(posts[['Courses', 'Post 1 By', 'Post 1']])),
+
+        load_table(connection, 'Comments',
+                   'INSERT or IGNORE INTO Comments (course_id, post_no, comment_no, student_email, comment_content) VALUES (?,1,1,?,?);',
+                   to_rows(comments[['Courses', 'Comment 1 By', 'Comment 1']])),
+    ]
+
+    with connection:
+        connection.executemany('INSERT or REPLACE INTO Metadata (name, value) VALUES (?,?);',
+                               sorted(input_hashes(source).items()) + [(SOURCE_KEY, source)])
 
     connection.close()
+    return stats
+
+
+def file_hash(path):
+    digest = h.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_hashes(source='.'):
+    hashes = {name: file_hash(os.path.join(source, name)) for name in CSV_FILES}
+    hashes[SCHEMA_FILE] = file_hash(SCHEMA_FILE)
+    return hashes
+
+
+# True if the database at path was populated from exactly the current input files and schema. The CSVs are hashed
+# in the directory it was populated from, the bundled ones unless it was built from another source.
+def is_current(path=None):
+    path = path or DATABASE_PATH
+    if not os.path.exists(path):
+        return False
+
+    connection = sql.connect(path)
+    try:
+        if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            return False
+        stored = dict(connection.execute('SELECT name, value FROM Metadata').fetchall())
+    except sql.OperationalError:
+        # No Metadata table, so this database predates versioning.
+        return False
+    finally:
+        connection.close()
+
+    source = stored.pop(SOURCE_KEY, '.')
+    try:
+        return stored == input_hashes(source)
+    except FileNotFoundError:
+        # the source it was built from is gone
+        return False
+
+
+# Copies a prebuilt database over path using sqlite's backup API.
+def restore_snapshot(snapshot, path=None):
+    source = sql.connect(snapshot)
+    target = sql.connect(path or DATABASE_PATH)
+    with target:
+        source.backup(target)
+    source.close()
+    target.close()
+
+
+# Writes a copy of the database at path to snapshot, for booting other instances from.
+def write_snapshot(snapshot, path=None):
+    restore_snapshot(path or DATABASE_PATH, snapshot)
+
+
+# Brings the database up to date, doing as little work as possible.
+# An existing database is first migrated to the latest schema. After that nothing more is done if it was already
+# built from the current inputs, otherwise the snapshot is restored if it was built from the current inputs, and a
+# full populate() only happens if neither is current.
+# A lock file keeps several workers booting at once from populating the same database together.
+def ensure_populated(path=None, snapshot=None):
+    path = path or DATABASE_PATH
+
+    with open(path + '.lock', 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # Schema changes are applied in place, they never need the data reloaded.
+        if os.path.exists(path):
+            connection = sql.connect(path)
+            migrate(connection)
+            connection.close()
+
+        if is_current(path):
+            log.info("Database is current, skipping populate")
+            return False
+
+        if snapshot and is_current(snapshot):
+            log.info("Restoring database from snapshot %s", snapshot)
+            restore_snapshot(snapshot, path)
+            return True
+
+        log.info("Populating DB")
+        populate(path)
+        return True
+
 
 if __name__ == "__main__":
-    populate()
\ No newline at end of file
+    # python PopulateScript.py [snapshot]
+    # Rebuilds the database and, if a path is given, writes a snapshot of it there.
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    populate()
+    if len(sys.argv) > 1:
+        write_snapshot(sys.argv[1])
@@ -1,41 +1,125 @@
-from flask import Flask, render_template, request, flash, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, current_app, render_template, request, flash, redirect, stream_with_context, url_for
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from cache import LRUCache, MISSING
+from catalog import get_catalog
 from secrets import token_hex
-from PopulateScript import populate
+from database import db, init_app, get_connection, immediate_transaction
+from pagecache import CATALOG, cached_page, course_posts, page_cache
+from passwords import check_password, hash_password
+from viewer import get_viewer, forget_viewer, user_version, viewer_cache
+import metrics
+import profiling
 
 from datetime import datetime
+from time import monotonic
 
-import sqlite3 as sql
-import hashlib as hash
+import csv
+import io
+import os
+import re
 
 # Flask is for the main rendering of HTML pages as well as url mapping.
 # SQLAlchemy is used for the user class used for flask_login
+# database holds the connection pool shared by SQLAlchemy and the sqlite helpers below.
+# catalog keeps courses, sections, professors and zipcodes in memory, since they rarely change.
+# viewer resolves the logged in user's role, enrollments and teaching teams once per request.
 # flask_login is used as a login manager, keeping track of which users are logged in.
 # datetime is used for comparing dates for dropping classes.
-# sqlite3 is used to communicate with my database.
-# hashlib is used to hash the database passwords using MD4 format.
+# csv reads the grade files professors upload and writes the gradebooks they download.
+# passwords hashes and checks passwords, upgrading old MD4 hashes as users log in.
+# metrics times each route and the SQL it runs, and serves the totals at /metrics.
+# pagecache keeps rendered pages that look the same to everyone with the same role, until the data behind them changes.
+# profiling runs cProfile on sampled requests, or ones carrying the profiling token, and lists the results.
 
-app = Flask("NittanyPath-v1")
-app.secret_key = token_hex(16)
+login_manager = LoginManager()
 
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///database.db"
-db = SQLAlchemy(app)
-db.Model.metadata.reflect(db.engine)
+# The views @route collects, added to every app create_app() builds.
+routes = []
 
-login = LoginManager(app)
+
+# Like app.route, but for every app create_app() builds. Views keep their function names as endpoints.
+def route(rule, **options):
+    def register(view):
+        routes.append((rule, view, options))
+        return view
+
+    return register
+
+
+# Builds the app. This only configures it: the database is first opened, and its schema brought up to date, when a
+# request or command first needs it (see database.py). config overrides the settings below.
+def create_app(config=None):
+    app = Flask("NittanyPath-v1")
+    # every worker process of a server must sign sessions with the same key, so it can be given with
+    # NITTANYPATH_SECRET_KEY. Otherwise each start makes a new one, logging everyone out.
+    app.secret_key = os.environ.get('NITTANYPATH_SECRET_KEY') or token_hex(16)
+
+    # how many posts are shown per page of a course's board, and comments per post before a "load more" link.
+    app.config['POSTS_PER_PAGE'] = int(os.environ.get('NITTANYPATH_POSTS_PER_PAGE', 20))
+    app.config['COMMENTS_PER_POST'] = int(os.environ.get('NITTANYPATH_COMMENTS_PER_POST', 5))
+
+    # how many courses a page of class search shows.
+    app.config['CLASSES_PER_PAGE'] = int(os.environ.get('NITTANYPATH_CLASSES_PER_PAGE', 30))
+
+    # the largest request body accepted, which bounds grade file uploads.
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('NITTANYPATH_MAX_UPLOAD_BYTES', 2 * 1024 * 1024))
+
+    if config:
+        app.config.update(config)
+
+    init_app(app)
+    login_manager.init_app(app)
+    metrics.init_app(app, {'viewer': viewer_cache, 'user': user_cache, 'page': page_cache})
+    profiling.init_app(app)
+
+    for rule, view, options in routes:
+        app.add_url_rule(rule, view.__name__, view, **options)
+
+    return app
+
+
+# Users flask_login loads for each request are kept for a short while, detached from any session so every thread can
+# share them, and served without touching the database. Each is kept with the user's version (see viewer.py), which
+# is only checked again once NITTANYPATH_USER_CHECK_SECONDS have passed: so a new password or name set in another
+# worker process is seen within that long, while updatePassword drops the user from this one at once.
+user_cache = LRUCache(int(os.environ.get('NITTANYPATH_USER_CACHE_SIZE', 10000)),
+                      int(os.environ.get('NITTANYPATH_USER_CACHE_TTL', 60)))
+
+USER_CHECK_SECONDS = float(os.environ.get('NITTANYPATH_USER_CHECK_SECONDS', 1))
 
 
 # Used to load a user from User class.
-@login.user_loader
+@login_manager.user_loader
 def load_user(email):
-    return User.query.get(email)
+    entry = user_cache.get(email)
+    if entry is not MISSING and monotonic() < entry[1]:
+        return entry[2]
+
+    version = user_version(email)
+    if entry is MISSING or entry[0] != version:
+        user = find_user(email)
+        if user is None:
+            return None
+    else:
+        user = entry[2]
+    user_cache.set(email, (version, monotonic() + USER_CHECK_SECONDS, user))
+    return user
+
+
+# Returns the User with this email, or None. It is read on the request's connection like everything else, so a
+# request never checks a second connection out of the pool for the ORM session.
+def find_user(email):
+    cursor = get_connection().execute(
+        'SELECT email, password_hashed, name, age, gender FROM User WHERE email = ?', (email,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return User(email=row[0], password=row[1], name=row[2], age=row[3], gender=row[4])
 
 
 # User Class for SQLAlchemy
 class User(UserMixin, db.Model):
     __tablename__ = "User"
-    __table_args__ = {'extend_existing': True}
 
     email = db.Column("email", db.Text, primary_key=True)
     password = db.Column("password_hashed", db.Text)
@@ -55,15 +139,19 @@ class User(UserMixin, db.Model):
     def get_id(self):
         return self.email
 
+    # The user as their row of the User table.
+    def row(self):
+        return self.email, self.password, self.name, self.age, self.gender
+
 
 # Used to render the home page.
-@app.route('/')
+@route('/')
 def index():
-    return render_template('index.html')
+    return cached_page([], None, lambda: render_template('index.html'))
 
 
 # logic for the login page.
-@app.route('/login/', methods=['POST', 'GET'])
+@route('/login/', methods=['POST', 'GET'])
 def login():
     error = None
 
@@ -78,25 +166,20 @@ def login():
             flash("invalid username or password")
             return render_template('login.html', submission=False)
 
-        connection = sql.connect('database.db')
-
-        # check users for the email.
-        cursor = connection.execute('SELECT * FROM User WHERE email = ?', (request.form['loginEmail'],))
-        row = cursor.fetchone()
+        # check users for the email, then the password. Unknown emails are checked too, so they take as long.
+        user = find_user(request.form['loginEmail'])
+        matches, new_password = check_password(request.form['loginPassword'], user.password if user else None)
 
-        # if the email exists within database.
-        if row:
+        if matches:
+            # passwords stored with an old algorithm or cost are stored again the current way.
+            if new_password:
+                updatePassword(user.email, new_password)
 
-            # check the password
-            given_password = hash.new('md4', request.form['loginPassword'].encode()).hexdigest()
+            # User will be logged in.
+            login_user(user)
 
-            if given_password == row[1]:
-                # User will be logged in.
-                user = User.query.filter_by(email=request.form['loginEmail']).first()
-                login_user(user)
-
-                # send them to the dashboard
-                return redirect(url_for('dashboard'))
+            # send them to the dashboard
+            return redirect(url_for('dashboard'))
 
         flash("invalid username or password")
         return render_template('login.html', error=error, submission=False)
@@ -105,7 +188,7 @@ def login():
 
 
 # logs out the user.
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout():
     logout_user()
@@ -113,10 +196,10 @@ def logout():
 
 
 # the main dashboard for users.
-@app.route('/dashboard')
+@route('/dashboard')
 @login_required
 def dashboard():
-    userType = get_user_type(current_user.email)
+    userType = get_viewer().user_type
     classes = None
 
     # if user is a student, give them the student view.
@@ -141,7 +224,7 @@ def dashboard():
 # displays assignment, exam, and post information for students.
 # displays controls for professors.
 # displays posts for TAs.
-@app.route('/classInfo/<class_id>', methods=['GET', 'POST'])
+@route('/classInfo/<class_id>', methods=['GET', 'POST'])
 @login_required
 def classInfo(class_id):
     # get course info.
@@ -150,7 +233,7 @@ def classInfo(class_id):
     if request.method == 'POST':
 
         # Post method is only used for enrolled students to drop the course.
-        if isEnrolled(current_user.email, class_id):
+        if get_viewer().is_enrolled(class_id):
             section = get_student_section(current_user.email, class_id)
             dropCourse(current_user.email, class_id, section[2])
         return redirect(url_for('dashboard'))
@@ -160,52 +243,47 @@ def classInfo(class_id):
         return redirect(url_for('dashboard'))
 
     # get user's type
-    user_type = get_user_type(current_user.email)
+    user_type = get_viewer().user_type
 
     if user_type == 'student':
 
         # if student is a TA for the class, return view for TA.
-        if isTAforClass(current_user.email, class_id):
+        if get_viewer().is_ta_for(class_id):
             # TA Teaches this class!
-            return render_template('classInfo.html', isStudent=True, isEnrolled=False, isTA=True, isProf=False,
-                                   courseInfo=courseInfo)
+            return cached_page([CATALOG], 'ta', lambda: render_template(
+                'classInfo.html', isStudent=True, isEnrolled=False, isTA=True, isProf=False, courseInfo=courseInfo))
 
         # if user is enrolled in the class.
-        if isEnrolled(current_user.email, class_id):
+        if get_viewer().is_enrolled(class_id):
             # get professor and section information.
             professor = get_professor_contact(courseInfo[3])
             section = get_student_section(current_user.email, class_id)
 
-            avgHWGrade = get_avg_hw_grade(current_user.email, class_id)
-            avgExamGrade = get_avg_exam_grade(current_user.email, class_id)
-            totalGrade = get_total_grade(current_user.email, class_id)
-            print(avgHWGrade)
-            print(avgExamGrade)
-            print(totalGrade)
+            avgHWGrade, avgExamGrade, totalGrade = get_grade_summary(current_user.email, class_id)
 
             # return view for enrolled student.
             return render_template('classInfo.html', avgHWGrade=avgHWGrade, avgExamGrade=avgExamGrade, totalGrade=totalGrade, sec_no=section[2], isStudent=True, isEnrolled=True, isTA=False,
                                    isProf=False, courseInfo=courseInfo, professor=professor)
 
         # if student is not enrolled AND is not a TA, return standard student view.
-        return render_template('classInfo.html', isStudent=True, isEnrolled=False, isTA=False, isProf=False,
-                               courseInfo=courseInfo)
+        return cached_page([CATALOG], 'student', lambda: render_template(
+            'classInfo.html', isStudent=True, isEnrolled=False, isTA=False, isProf=False, courseInfo=courseInfo))
     else:
 
         # user must be a professor.
-        if isProfForClass(current_user.email, class_id):
+        if get_viewer().is_prof_for(class_id):
             # Professor Teaches this class, give them main professor control view.
-            return render_template('classInfo.html', isStudent=False, isEnrolled=True, isTA=False, isProf=True,
-                                   courseInfo=courseInfo)
+            return cached_page([CATALOG], 'teaching', lambda: render_template(
+                'classInfo.html', isStudent=False, isEnrolled=True, isTA=False, isProf=True, courseInfo=courseInfo))
 
         # Professor does not teach this class, return standard course view.
-        return render_template('classInfo.html', isStudent=False, isEnrolled=False, isTA=False, isProf=True,
-                               courseInfo=courseInfo)
+        return cached_page([CATALOG], 'professor', lambda: render_template(
+            'classInfo.html', isStudent=False, isEnrolled=False, isTA=False, isProf=True, courseInfo=courseInfo))
 
 
 # logic for assignments page, displays assignments to enrolled students and professor.
 # redirects to dashboard for other users.
-@app.route('/classInfo/<class_id>/Assignments')
+@route('/classInfo/<class_id>/Assignments')
 @login_required
 def classInfoAssignments(class_id):
     courseInfo = get_class_info(class_id)
@@ -213,45 +291,20 @@ def classInfoAssignments(class_id):
     if not courseInfo:
         return redirect(url_for('dashboard'))
 
-    user_type = get_user_type(current_user.email)
+    user_type = get_viewer().user_type
 
     if user_type == 'student':
 
-        if isEnrolled(current_user.email, class_id):
+        if get_viewer().is_enrolled(class_id):
             section = get_student_section(current_user.email, class_id)
-            assignments = get_homework(class_id, section[2])
-            assign_grades = get_homework_grades(current_user.email, class_id, section[2])
-
-            returnAssigns = []
-            flag = False
-
-            if assignments:
-                if assign_grades:
-                    for assignment in assignments:
-                        for grade in assign_grades:
-                            if grade[3] == assignment[2]:
-                                # if the grade is for assignment 2
-                                returnAssigns.append((grade[3], assignment[3], grade[4]))
-                                Flag = True
-                        if Flag:
-                            Flag = False
-                        else:
-                            returnAssigns.append((assignment[2], assignment[3], '-'))
-                else:
-                    for assignment in assignments:
-                        returnAssigns.append((assignment[2], assignment[3], "-"))
+            returnAssigns = get_student_assignments(current_user.email, class_id, section[2], 'homework')
             return render_template('assignments.html', courseInfo=courseInfo, assignments=returnAssigns, isStudent=True,
                                    isProf=False)
         else:
             return redirect(url_for('dashboard'))
     else:
-        taughtClasses = get_taught_classes(current_user.email)
-        if taughtClasses[0][0] == class_id:
-            sections = get_sections(class_id)
-            total_assignments = []
-            for section in sections:
-                assignments = get_homework(class_id, section[1])
-                total_assignments.append((section[1], assignments))
+        if get_viewer().is_prof_for(class_id):
+            total_assignments = get_section_assignments(class_id, 'homework')
             return render_template('assignments.html', courseInfo=courseInfo, total_assignments=total_assignments,
                                    isStudent=False,
                                    isProf=True)
@@ -259,25 +312,30 @@ def classInfoAssignments(class_id):
         return redirect(url_for('dashboard'))
 
 
-@app.route('/classInfo/<class_id>/Assignments/<sec_no>/<assignment_no>', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/Assignments/<sec_no>/<assignment_no>', methods=['POST', 'GET'])
 @login_required
 def gradeAssignments(class_id, sec_no, assignment_no):
-    if not isProfForClass(current_user.email, class_id):
-        return redirect(url_for(dashboard))
+    if not get_viewer().is_prof_for(class_id):
+        return redirect(url_for('dashboard'))
 
     courseInfo = get_class_info(class_id)
 
+    report = None
     if request.method == 'POST':
-        email = request.form["grade button"]
-        grade = request.form['gradeToChange']
-        change_hw_grade(email, class_id, sec_no, assignment_no, grade)
+        if "grade button" in request.form:
+            email = request.form["grade button"]
+            grade = request.form['gradeToChange']
+            change_hw_grade(email, class_id, sec_no, assignment_no, grade)
+        else:
+            grades = get_student_HW_grades(class_id, sec_no, assignment_no)
+            report = grade_batch('homework', class_id, sec_no, assignment_no, grades)
 
     grades = get_student_HW_grades(class_id, sec_no, assignment_no)
     return render_template('gradeAssignments.html', courseInfo=courseInfo, sec_no=sec_no, assignment_no=assignment_no,
-                           grades=grades)
+                           grades=grades, report=report)
 
 
-@app.route('/classInfo/<class_id>/Exams')
+@route('/classInfo/<class_id>/Exams')
 @login_required
 def classInfoExams(class_id):
     courseInfo = get_class_info(class_id)
@@ -285,82 +343,75 @@ def classInfoExams(class_id):
     if not courseInfo:
         return redirect(url_for('dashboard'))
 
-    user_type = get_user_type(current_user.email)
+    user_type = get_viewer().user_type
 
     if user_type == 'student':
 
-        if isEnrolled(current_user.email, class_id):
+        if get_viewer().is_enrolled(class_id):
             section = get_student_section(current_user.email, class_id)
-            assignments = get_exams(class_id, section[2])
-            assign_grades = get_exam_grades(current_user.email, class_id, section[2])
-            returnAssigns = []
-            flag = False
-
-            if assignments:
-                if assign_grades:
-                    for assignment in assignments:
-                        for grade in assign_grades:
-                            if grade[3] == assignment[2]:
-                                # if the grade is for assignment 2
-                                returnAssigns.append((grade[3], assignment[3], grade[4]))
-                                Flag = True
-                        if Flag:
-                            Flag = False
-                        else:
-                            returnAssigns.append((assignment[2], assignment[3], "-"))
-                else:
-                    for assignment in assignments:
-                        returnAssigns.append((assignment[2], assignment[3], "-"))
+            returnAssigns = get_student_assignments(current_user.email, class_id, section[2], 'exam')
             return render_template('exams.html', courseInfo=courseInfo, assignments=returnAssigns, isStudent=True,
                                    isProf=False)
         else:
             return redirect(url_for('dashboard'))
     else:
-        taughtClasses = get_taught_classes(current_user.email)
-        if taughtClasses[0][0] == class_id:
-            sections = get_sections(class_id)
-            total_assignments = []
-            for section in sections:
-                assignments = get_exams(class_id, section[1])
-                total_assignments.append((section[1], assignments))
+        if get_viewer().is_prof_for(class_id):
+            total_assignments = get_section_assignments(class_id, 'exam')
             return render_template('exams.html', courseInfo=courseInfo, total_assignments=total_assignments,
                                    isStudent=False, isProf=True)
 
         return redirect(url_for('dashboard'))
 
 
-@app.route('/classInfo/<class_id>/Exams/<sec_no>/<assignment_no>', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/Exams/<sec_no>/<assignment_no>', methods=['POST', 'GET'])
 @login_required
 def gradeExams(class_id, sec_no, assignment_no):
-    if not isProfForClass(current_user.email, class_id):
-        return redirect(url_for(dashboard))
+    if not get_viewer().is_prof_for(class_id):
+        return redirect(url_for('dashboard'))
 
     courseInfo = get_class_info(class_id)
 
+    report = None
     if request.method == 'POST':
-        email = request.form["grade button"]
-        grade = request.form['gradeToChange']
-        change_exam_grade(email, class_id, sec_no, assignment_no, grade)
+        if "grade button" in request.form:
+            email = request.form["grade button"]
+            grade = request.form['gradeToChange']
+            change_exam_grade(email, class_id, sec_no, assignment_no, grade)
+        else:
+            grades = get_student_exam_grades(class_id, sec_no, assignment_no)
+            report = grade_batch('exam', class_id, sec_no, assignment_no, grades)
 
     grades = get_student_exam_grades(class_id, sec_no, assignment_no)
     return render_template('gradeExams.html', courseInfo=courseInfo, sec_no=sec_no, assignment_no=assignment_no,
-                           grades=grades)
+                           grades=grades, report=report)
+
+
+# Downloads a section's whole gradebook as CSV. It is written out as it is read, so it never sits in memory whole.
+@route('/classInfo/<class_id>/Gradebook/<sec_no>')
+@login_required
+def exportGradebook(class_id, sec_no):
+    if not get_viewer().is_prof_for(class_id):
+        return redirect(url_for('dashboard'))
 
+    filename = '%s-section-%s-gradebook.csv' % (re.sub(r'[^\w-]', '', class_id), re.sub(r'[^\w-]', '', sec_no))
+    return Response(stream_with_context(stream_gradebook(class_id, sec_no)), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename="%s"' % filename})
 
-@app.route('/classInfo/<class_id>/createAssignment', methods=['POST', 'GET'])
+
+@route('/classInfo/<class_id>/createAssignment', methods=['POST', 'GET'])
 @login_required
 def createAssignment(class_id):
-    if not isProfForClass(current_user.email, class_id):
+    if not get_viewer().is_prof_for(class_id):
         return redirect(url_for('dashboard'))
 
     sections = get_sections(class_id)
     return render_template('createAssignment.html', sections=sections, class_id=class_id)
 
 
-@app.route('/classInfo/<class_id>/createAssignment/<sec_no>/<types>', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/createAssignment/<sec_no>/<types>', methods=['POST', 'GET'])
 @login_required
 def createAssignments(class_id, sec_no, types):
-    if not isProfForClass(current_user.email, class_id):
+    if not get_viewer().is_prof_for(class_id):
         return redirect(url_for('dashboard'))
 
     if types == 'False':
@@ -378,27 +429,27 @@ def createAssignments(class_id, sec_no, types):
     return redirect(url_for('createAssignment', class_id=class_id))
 
 
-@app.route('/classInfo/<class_id>/Enroll', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/Enroll', methods=['POST', 'GET'])
 @login_required
 def classEnroll(class_id):
     courseInfo = get_class_info(class_id)
-    if get_user_type(current_user.email) == "professor":
+    if get_viewer().user_type == "professor":
         return redirect(url_for('dashboard'))
 
-    if isEnrolled(current_user.email, class_id):
+    if get_viewer().is_enrolled(class_id):
         return redirect(url_for('dashboard'))
 
     sections = get_sections(class_id)
     return render_template('classEnroll.html', courseInfo=courseInfo, class_id=class_id, sections=sections)
 
 
-@app.route('/classInfo/<class_id>/Enroll/<sec_no>', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/Enroll/<sec_no>', methods=['POST', 'GET'])
 @login_required
 def enrollingClass(class_id, sec_no):
-    if get_user_type(current_user.email) == "professor":
+    if get_viewer().user_type == "professor":
         return redirect(url_for('dashboard'))
 
-    if isEnrolled(current_user.email, class_id):
+    if get_viewer().is_enrolled(class_id):
         return redirect(url_for('dashboard'))
 
     if canEnroll(current_user.email, class_id, sec_no):
@@ -407,39 +458,35 @@ def enrollingClass(class_id, sec_no):
     return redirect(url_for('dashboard'))
 
 
-@app.route('/classInfo/<class_id>/Posts', methods=['POST', 'GET'])
+@route('/classInfo/<class_id>/Posts', methods=['POST', 'GET'])
 @login_required
 def displayPosts(class_id):
-    courseInfo = get_class_info(class_id)
-
     if request.method == 'POST':
-        if isEnrolled(current_user.email, class_id) or isTAforClass(current_user.email, class_id) or isProfForClass(
-                current_user.email, class_id):
+        if get_viewer().can_post(class_id):
             content = request.form.get('PostTextArea')
             if content != "":
                 addPost(class_id, current_user.email, content)
 
-    if isEnrolled(current_user.email, class_id) or isTAforClass(current_user.email, class_id) or isProfForClass(
-            current_user.email, class_id):
-        posts = get_posts(class_id)
+    if get_viewer().can_post(class_id):
+        # the board is paged by post number, ?after=<post_no> gives the page after that post.
+        after = request.args.get('after', 0, type=int)
 
-        rposts = []
-        for post in posts:
-            comments = get_comments(post)
-            rcomments = []
-            for comm in comments:
-                rcomments.append((comm[2], get_name(comm[3]), comm[4]))
-            rposts.append((post[1], get_name(post[2]), post[3], rcomments))
+        def render():
+            courseInfo = get_class_info(class_id)
+            rposts, next_after = get_post_threads(class_id, after=after, limit=current_app.config['POSTS_PER_PAGE'],
+                                                  comment_limit=current_app.config['COMMENTS_PER_POST'])
+            return render_template('posts.html', posts=rposts, courseInfo=courseInfo, after=after,
+                                   next_after=next_after)
 
-        return render_template('posts.html', posts=rposts, courseInfo=courseInfo)
+        return cached_page([course_posts(class_id), CATALOG], None, render)
     else:
         return redirect(url_for('dashboard'))
 
 
-@app.route('/userProfile', methods=['GET', 'POST'])
+@route('/userProfile', methods=['GET', 'POST'])
 @login_required
 def userProfile():
-    userType = get_user_type(current_user.email)
+    userType = get_viewer().user_type
     wentThrough = False
     shouldFlash = False
 
@@ -449,16 +496,12 @@ def userProfile():
         if request.form['oldP'] == "" or request.form['newP'] == '' or request.form['newPC'] == '':
             flash("One or more invalid passwords")
         else:
-            connection = sql.connect('database.db')
-            cursor = connection.execute('SELECT * FROM User WHERE email = ?', (current_user.email,))
-            row = cursor.fetchone()
-
-            current_password = row[1]
+            current_password = current_user.password
             given_password = request.form['oldP']
 
             if comparePasswords(given_password, current_password):
                 if request.form['newP'] == request.form['newPC']:
-                    new_password = hash.new('md4', request.form['newPC'].encode()).hexdigest()
+                    new_password = hash_password(request.form['newPC'])
                     updatePassword(current_user.email, new_password)
                     wentThrough = True
                     flash('Updated password!')
@@ -474,20 +517,41 @@ def userProfile():
 
     if userType == 'student':
         studentInfo = get_student_info(current_user.email)
-        userInfo = get_user_info(current_user.email)
+        userInfo = current_user.row()
         zipcodeInfo = getZipcodeInfo(studentInfo[3])
         return render_template('userInfo.html', userInfo=userInfo, studentInfo=studentInfo, isStudent=True,
                                shouldFlash=shouldFlash, wentThrough=wentThrough, zipcodeInfo=zipcodeInfo)
     else:
-        userInfo = get_user_info(current_user.email)
+        userInfo = current_user.row()
         profInfo = get_professor_info(current_user.email)
         return render_template('userInfo.html', userInfo=userInfo, profInfo=profInfo, isStudent=False,
                                shouldFlash=shouldFlash, wentThrough=wentThrough)
 
 
-@app.route('/classInfo/<class_id>/Posts/<post_no>', methods=['POST'])
+@route('/classInfo/<class_id>/Posts/<post_no>', methods=['POST', 'GET'])
 @login_required
 def comment(class_id, post_no):
+    # GET shows a single post with the next page of its comments, ?after=<comment_no> continues from that comment.
+    if request.method == 'GET':
+        if not post_no.isdigit():
+            return redirect(url_for('displayPosts', class_id=class_id))
+
+        if not get_viewer().can_post(class_id):
+            return redirect(url_for('dashboard'))
+
+        def render():
+            courseInfo = get_class_info(class_id)
+            after = request.args.get('after', 0, type=int)
+            rposts, next_after = get_post_threads(class_id, after=int(post_no) - 1, limit=1, comments_after=after,
+                                                  comment_limit=current_app.config['COMMENTS_PER_POST'])
+
+            if not rposts or rposts[0][0] != int(post_no):
+                return redirect(url_for('displayPosts', class_id=class_id))
+
+            return render_template('posts.html', posts=rposts, courseInfo=courseInfo, after=None, next_after=None)
+
+        return cached_page([course_posts(class_id), CATALOG], None, render)
+
     if request.method == 'POST':
         theComment = request.form.get(post_no)
 
@@ -497,162 +561,147 @@ def comment(class_id, post_no):
         return redirect(url_for("displayPosts", class_id=class_id))
 
 
-@app.route('/classSearch')
+# lists courses a page at a time, ?q= searches course ids, names and descriptions and ?page= picks the page.
+@route('/classSearch')
 @login_required
 def classSearch():
-    classes = get_all_classes()
-    first, second, third = [classes[start::3] for start in range(3)]
-    num_classes = get_num_of_classes()
-    return render_template('classSearch.html', first=first, second=second, third=third, num_classes=num_classes)
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
 
+    def render():
+        classes, has_more = search_classes(q, page, current_app.config['CLASSES_PER_PAGE'])
+        first, second, third = [classes[start::3] for start in range(3)]
+        return render_template('classSearch.html', first=first, second=second, third=third, q=q, page=page,
+                               has_more=has_more)
 
-def get_posts(course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Posts WHERE course_id = ? ORDER BY post_no', (course_id,))
-    result = cursor.fetchall()
-
-    return result
-
-
-def comparePasswords(given_password, current_password):
-    given_password = hash.new('md4', given_password.encode()).hexdigest()
-    if given_password == current_password:
-        return True
-    return False
-
+    return cached_page([CATALOG], None, render)
 
-def get_comments(post):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Comments WHERE course_id = ? AND post_no = ? ORDER BY comment_no',
-                                (post[0], post[1],))
-    result = cursor.fetchall()
 
-    return result
+# Loads a page of posts in a course with their comments and author names in one query.
+# Posts are paged by post number: the page holds up to limit posts after the post numbered after.
+# Each post carries at most comment_limit comments numbered after comments_after.
+# Returns ([(post_no, author name, content, [(comment_no, author name, content)], more comments)], next_after)
+# for posts.html, where next_after is the cursor for the next page or None on the last page.
+def get_post_threads(course_id, after=0, limit=-1, comments_after=0, comment_limit=-1):
+    connection = get_connection()
 
+    # one extra post and one extra comment per post are fetched to tell if there is more to page through.
+    post_limit = limit + 1 if limit >= 0 else -1
+    comments_limit = comment_limit + 1 if comment_limit >= 0 else -1
 
-def addComment(email, course_id, post_no, comment_contents):
-    connection = sql.connect('database.db')
     cursor = connection.execute(
-        'SELECT MAX(comment_no) FROM Comments WHERE course_id = ? AND post_no = ? ORDER BY post_no DESC',
-        (course_id, post_no,))
-    result = cursor.fetchone()
+        'WITH page AS ('
+        '    SELECT course_id, post_no, student_email, post_content FROM Posts '
+        '    WHERE course_id = ? AND post_no > ? ORDER BY post_no LIMIT ?'
+        ') '
+        'SELECT p.post_no, pu.name, p.post_content, c.comment_no, cu.name, c.comment_content '
+        'FROM page p '
+        'LEFT JOIN User pu ON pu.email = p.student_email '
+        'LEFT JOIN Comments c ON c.course_id = p.course_id AND c.post_no = p.post_no AND c.comment_no IN ('
+        '    SELECT comment_no FROM Comments WHERE course_id = p.course_id AND post_no = p.post_no '
+        '    AND comment_no > ? ORDER BY comment_no LIMIT ?) '
+        'LEFT JOIN User cu ON cu.email = c.student_email '
+        'ORDER BY p.post_no, c.comment_no', (course_id, after, post_limit, comments_after, comments_limit))
+
+    rposts = []
+    for post_no, post_name, post_content, comment_no, comment_name, comment_content in cursor:
+        if not rposts or rposts[-1][0] != post_no:
+            rposts.append((post_no, post_name, post_content, [], False))
+        if comment_no is not None:
+            rposts[-1][3].append((comment_no, comment_name, comment_content))
+
+    next_after = None
+    if 0 <= limit < len(rposts):
+        rposts = rposts[:limit]
+        next_after = rposts[-1][0] if rposts else None
+
+    for i, (post_no, post_name, post_content, rcomments, more) in enumerate(rposts):
+        if 0 <= comment_limit < len(rcomments):
+            rposts[i] = (post_no, post_name, post_content, rcomments[:comment_limit], True)
+
+    return rposts, next_after
 
-    if result[0]:
-        comment_no = int(result[0] + 1)
-    else:
-        comment_no = 1
 
-        post_no = int(post_no)
+def comparePasswords(given_password, current_password):
+    return check_password(given_password, current_password)[0]
 
-    connection.execute(
-        'INSERT INTO Comments (course_id, post_no, comment_no, student_email, comment_content) VALUES (?,?,?,?,?);',
-        (course_id, post_no, comment_no, email, comment_contents,))
-    connection.commit()
 
+# Numbers the comment after the post's last one in the same statement that inserts it, under the write lock, so two
+# comments posted at once never get the same number.
+def addComment(email, course_id, post_no, comment_contents):
+    post_no = int(post_no)
 
-def get_name(email):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT name FROM User WHERE email = ?', (email,))
-    result = cursor.fetchone()
-    return result[0]
+    connection = get_connection()
+    with immediate_transaction(connection):
+        connection.execute(
+            'INSERT INTO Comments (course_id, post_no, comment_no, student_email, comment_content) '
+            'SELECT ?, ?, COALESCE(MAX(comment_no), 0) + 1, ?, ? FROM Comments WHERE course_id = ? AND post_no = ?',
+            (course_id, post_no, email, comment_contents, course_id, post_no,))
 
 
+# Numbers the post like addComment does, so concurrent posts to a course never collide.
 def addPost(course_id, email, content):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT MAX(post_no) FROM Posts WHERE course_id = ?', (course_id,))
-    result = cursor.fetchone()
-
-    if result[0]:
-        post_no = result[0] + 1
-    else:
-        post_no = 1
-
-    connection.execute('INSERT INTO Posts (course_id, post_no, student_email, post_content) VALUES (?,?,?,?);',
-                       (course_id, post_no, email, content,))
-    connection.commit()
+    connection = get_connection()
+    with immediate_transaction(connection):
+        connection.execute(
+            'INSERT INTO Posts (course_id, post_no, student_email, post_content) '
+            'SELECT ?, COALESCE(MAX(post_no), 0) + 1, ?, ? FROM Posts WHERE course_id = ?',
+            (course_id, email, content, course_id,))
 
 
 def isTAforClass(email, course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM TA_Teaching_Teams WHERE student_email = ?', (email,))
-    result = cursor.fetchone()
-
-    if result:
-        tt_id = result[1]
-    else:
-        return False
-
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Courses WHERE course_id = ?', (course_id,))
-    result = cursor.fetchone()
-
-    class_tt_id = result[3]
-
-    if tt_id == class_tt_id:
-        return True
-
-    return False
+    return get_viewer(email).is_ta_for(course_id)
 
 
 def getZipcodeInfo(zipcode):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Zipcodes WHERE zipcode = ?', (zipcode,))
-    result = cursor.fetchone()
-    return result
+    return get_catalog().zipcode(zipcode)
 
 
 def isProfForClass(email, course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Prof_Teaching_Teams WHERE prof_email = ?', (email,))
-    result = cursor.fetchone()
-
-    if result:
-        tt_id = result[1]
-    else:
-        return False
-
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Courses WHERE course_id = ?', (course_id,))
-    result = cursor.fetchone()
-
-    class_tt_id = result[3]
-
-    if tt_id == class_tt_id:
-        return True
-
-    return False
+    return get_viewer(email).is_prof_for(course_id)
 
 
+# Returns the student's Enrolls row for the course, or None if they are not enrolled.
 def get_student_section(email, course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Enrolls WHERE student_email = ? AND course_id = ?', (email, course_id,))
-    result = cursor.fetchone()
-
-    return result
+    viewer = get_viewer(email)
+    if viewer.is_enrolled(course_id):
+        return email, course_id, viewer.section(course_id)
+    return None
 
 
 def updatePassword(email, newPassword):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     connection.execute('UPDATE User SET password_hashed = ? WHERE email = ?', (newPassword, email))
     connection.commit()
+    user_cache.invalidate(email)
 
 
+# Enrolls a student in a section if it still has a free seat, returning whether they were enrolled.
+# The seat check and the insert are one statement inside an immediate transaction, so two students can never both
+# take the last seat. Sections.enrolled_count is kept current by a trigger on Enrolls.
+# The student's empty grade rows for every assignment and exam already in the section are added in the same
+# transaction, so a student is never left enrolled without them.
 def enrollUser(email, course_id, sec_no):
-    connection = sql.connect('database.db')
-    connection.execute('INSERT INTO Enrolls VALUES(?,?,?)', (email, course_id, sec_no,))
-    connection.commit()
-
-    assignments = get_homework(course_id, sec_no)
-    for assignment in assignments:
-        connection.execute(
-            'INSERT OR IGNORE INTO Homework_Grades(student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?)',
-            (email, course_id, sec_no, assignment[2], None))
-
-    assignments = get_exams(course_id, sec_no)
-    for assignment in assignments:
-        connection.execute(
-            'INSERT OR IGNORE INTO Exam_Grades(student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?)',
-            (email, course_id, sec_no, assignment[2], None))
+    connection = get_connection()
+    with immediate_transaction(connection):
+        cursor = connection.execute(
+            'INSERT OR IGNORE INTO Enrolls (student_email, course_id, section_no) '
+            'SELECT ?, course_id, sec_no FROM Sections WHERE course_id = ? AND sec_no = ? AND enrolled_count < max_limit',
+            (email, course_id, sec_no,))
+        enrolled = cursor.rowcount == 1
+
+        if enrolled:
+            connection.execute(
+                'INSERT OR IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) '
+                'SELECT ?, course_id, sec_no, hw_no, NULL FROM Homework WHERE course_id = ? AND sec_no = ?',
+                (email, course_id, sec_no,))
+            connection.execute(
+                'INSERT OR IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) '
+                'SELECT ?, course_id, sec_no, exam_no, NULL FROM Exams WHERE course_id = ? AND sec_no = ?',
+                (email, course_id, sec_no,))
+    forget_viewer(email)
+
+    return enrolled
 
 
 def canEnroll(email, course_id, sec_no):
@@ -665,118 +714,65 @@ def canEnroll(email, course_id, sec_no):
     if isTAforClass(email, course_id):
         return False
 
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT max_limit FROM Sections WHERE course_id = ? AND sec_no = ?',
-                                (course_id, sec_no,))
-    result = cursor.fetchone()
-    max_Enrolled = result[0]
-
-    cursor = connection.execute('SELECT COUNT(student_email) FROM Enrolls WHERE course_id = ? AND section_no = ?',
+    # enrollUser() checks the seat again when it enrolls, this only decides whether to try.
+    connection = get_connection()
+    cursor = connection.execute('SELECT enrolled_count < max_limit FROM Sections WHERE course_id = ? AND sec_no = ?',
                                 (course_id, sec_no,))
     result = cursor.fetchone()
-    enrolled = result[0]
 
-    if enrolled <= max_Enrolled:
+    if result and result[0]:
         return True
     return False
 
 
-def get_avg_hw_grade(email, course_id):
-    section = get_student_section(email, course_id)
-    section = section[2]
-
-    connection = sql.connect('database.db')
-    cursor = connection.execute(
-        'SELECT AVG(grade) FROM Homework_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    result = cursor.fetchone()[0]
-    return result
-
-
-def get_avg_exam_grade(email, course_id):
-    section = get_student_section(email, course_id)
-    section = section[2]
-
-    connection = sql.connect('database.db')
+# Reads a student's homework average, exam average and total grade in the section of a course they are enrolled in.
+# These come from Grade_Summary, which triggers keep current as grades change (see migrations.py).
+def get_grade_summary(email, course_id):
+    connection = get_connection()
     cursor = connection.execute(
-        'SELECT AVG(grade) FROM Exam_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    result = cursor.fetchone()[0]
+        'SELECT g.hw_avg, g.exam_avg, '
+        '(COALESCE(g.hw_sum, 0) + COALESCE(g.exam_sum, 0)) * 1.0 / NULLIF(g.hw_count + g.exam_count, 0) '
+        'FROM Enrolls e JOIN Grade_Summary g '
+        'ON g.student_email = e.student_email AND g.course_id = e.course_id AND g.sec_no = e.section_no '
+        'WHERE e.student_email = ? AND e.course_id = ?', (email, course_id,))
+    result = cursor.fetchone()
 
+    if not result:
+        return None, None, None
     return result
 
 
-def get_total_grade(email, course_id):
-    section = get_student_section(email, course_id)
-    section = section[2]
-
-    connection = sql.connect('database.db')
-    cursor = connection.execute(
-        'SELECT SUM(grade) FROM Exam_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    sumExamPoints = cursor.fetchone()[0]
-
-    cursor = connection.execute(
-        'SELECT COUNT(grade) FROM Exam_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    totalExamPoints = cursor.fetchone()[0]
-
-    connection = sql.connect('database.db')
-    cursor = connection.execute(
-        'SELECT SUM(grade) FROM Homework_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    sumHWPoints = cursor.fetchone()[0]
-
-    cursor = connection.execute(
-        'SELECT COUNT(grade) FROM Homework_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, section,))
-    totalHWPoints = cursor.fetchone()[0]
-
-    if not sumHWPoints:
-        sumHWPoints = 0
-    if not sumExamPoints:
-        sumExamPoints = 0
-    if not totalHWPoints:
-        totalHWPoints = 0
-    if not totalExamPoints:
-        totalExamPoints = 0
-
-    if totalExamPoints + totalHWPoints == 0:
-        return None
-
-    totalGrade = (sumExamPoints + sumHWPoints) / (totalExamPoints + totalHWPoints)
-    return totalGrade
-
-
+# Returns the Professors row of the teaching team's professor.
 def get_professor_contact(teaching_team_ID):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Prof_Teaching_Teams WHERE teaching_team_id = ?', (teaching_team_ID,))
-    result = cursor.fetchone()
-
-    cursor = connection.execute('SELECT * FROM Professors WHERE email = ?', (result[0],))
-    result = cursor.fetchone()
+    return get_catalog().professors.get(teaching_team_ID)
 
-    return result
 
+# Turns what a user typed into an FTS5 query matching courses that contain every word, or a word starting with it.
+def course_search_terms(text):
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', text))
 
-def get_all_classes():
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Courses')
-    result = cursor.fetchall()
-
-    return result
 
+# Returns a page of Courses rows and whether there is another page after it.
+# With search text the courses are ranked by how well they match it, otherwise they are listed by course id from the
+# catalog.
+def search_classes(text, page, page_size):
+    terms = course_search_terms(text)
+    offset = (page - 1) * page_size
 
-def get_num_of_classes():
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT COUNT(course_id) FROM Courses')
-    result = cursor.fetchone()
+    if terms:
+        connection = get_connection()
+        cursor = connection.execute(
+            'SELECT c.* FROM Courses_Search s JOIN Courses c ON c.rowid = s.rowid '
+            'WHERE Courses_Search MATCH ? ORDER BY s.rank LIMIT ? OFFSET ?', (terms, page_size + 1, offset,))
+        result = cursor.fetchall()
+    else:
+        result = list(get_catalog().course_list[offset:offset + page_size + 1])
 
-    return result[0]
+    return result[:page_size], len(result) > page_size
 
 
 def get_student_HW_grades(class_id, sec_no, assignment_no):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     cursor = connection.execute('SELECT * FROM Homework_Grades WHERE course_id = ? AND sec_no = ? AND hw_no = ?',
                                 (class_id, sec_no, assignment_no,))
     result = cursor.fetchall()
@@ -784,57 +780,68 @@ def get_student_HW_grades(class_id, sec_no, assignment_no):
 
 
 def get_student_exam_grades(class_id, sec_no, assignment_no):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     cursor = connection.execute('SELECT * FROM Exam_Grades WHERE course_id = ? AND sec_no = ? AND exam_no = ?',
                                 (class_id, sec_no, assignment_no,))
     result = cursor.fetchall()
     return result
 
 
+# Returns the course's sections as (course_id, sec_no, max_limit).
 def get_sections(course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Sections WHERE course_id = ?', (course_id,))
-    result = cursor.fetchall()
-    return result
-
-
-def get_exams(course_id, sec_no):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Exams WHERE course_id = ? AND sec_no = ?', (course_id, sec_no,))
-    result = cursor.fetchall()
+    return list(get_catalog().sections.get(course_id, ()))
 
-    return result
 
+# Each kind of assignment has its own tables, so the queries below come in one version per kind.
 
-def get_exam_grades(email, course_id, sec_no):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Exam_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-                                (email, course_id, sec_no,))
-    result = cursor.fetchall()
+# A student's assignments in their section as (number, details, grade).
+# The grade is the student's grade row, which may still be empty, or '-' if they have no grade row at all.
+STUDENT_ASSIGNMENTS = {
+    'homework': 'SELECT a.hw_no, a.hw_details, CASE WHEN g.student_email IS NULL THEN \'-\' ELSE g.grade END '
+                'FROM Homework a LEFT JOIN Homework_Grades g ON g.student_email = ? AND g.course_id = a.course_id '
+                'AND g.sec_no = a.sec_no AND g.hw_no = a.hw_no '
+                'WHERE a.course_id = ? AND a.sec_no = ? ORDER BY a.hw_no',
+    'exam': 'SELECT a.exam_no, a.exam_details, CASE WHEN g.student_email IS NULL THEN \'-\' ELSE g.grade END '
+            'FROM Exams a LEFT JOIN Exam_Grades g ON g.student_email = ? AND g.course_id = a.course_id '
+            'AND g.sec_no = a.sec_no AND g.exam_no = a.exam_no '
+            'WHERE a.course_id = ? AND a.sec_no = ? ORDER BY a.exam_no',
+}
 
-    return result
+# Every section of a course with each of its assignments, or one row of NULLs for a section without any.
+SECTION_ASSIGNMENTS = {
+    'homework': 'SELECT s.sec_no, a.* FROM Sections s '
+                'LEFT JOIN Homework a ON a.course_id = s.course_id AND a.sec_no = s.sec_no '
+                'WHERE s.course_id = ? ORDER BY s.sec_no, a.hw_no',
+    'exam': 'SELECT s.sec_no, a.* FROM Sections s '
+            'LEFT JOIN Exams a ON a.course_id = s.course_id AND a.sec_no = s.sec_no '
+            'WHERE s.course_id = ? ORDER BY s.sec_no, a.exam_no',
+}
 
 
-def get_homework(course_id, sec_no):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Homework WHERE course_id = ? AND sec_no = ?', (course_id, sec_no,))
-    result = cursor.fetchall()
+# Lists a student's assignments of one kind ('homework' or 'exam') in their section, with their grades.
+def get_student_assignments(email, course_id, sec_no, kind):
+    connection = get_connection()
+    cursor = connection.execute(STUDENT_ASSIGNMENTS[kind], (email, course_id, sec_no,))
+    return cursor.fetchall()
 
-    return result
 
+# Lists every section of a course with its assignments of one kind, as [(sec_no, [assignment rows])].
+def get_section_assignments(course_id, kind):
+    connection = get_connection()
+    cursor = connection.execute(SECTION_ASSIGNMENTS[kind], (course_id,))
 
-def get_homework_grades(email, course_id, sec_no):
-    connection = sql.connect('database.db')
-    cursor = connection.execute(
-        'SELECT * FROM Homework_Grades WHERE student_email = ? AND course_id = ? AND sec_no = ?',
-        (email, course_id, sec_no,))
-    result = cursor.fetchall()
+    total_assignments = []
+    for sec_no, *assignment in cursor:
+        if not total_assignments or total_assignments[-1][0] != sec_no:
+            total_assignments.append((sec_no, []))
+        if assignment[0] is not None:
+            total_assignments[-1][1].append(tuple(assignment))
 
-    return result
+    return total_assignments
 
 
 def get_enrolled_classes(email):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     cursor = connection.execute('SELECT * FROM Enrolls WHERE student_email = ?', (email,))
     result = cursor.fetchall()
 
@@ -848,94 +855,47 @@ def get_enrolled_classes(email):
 
 
 def get_class_info(course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Courses WHERE course_id = ?', (course_id,))
-    result = cursor.fetchone()
-    return result
-
-
-def get_user_info(email):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM User WHERE email = ?', (email,))
-    result = cursor.fetchone()
-    return result
+    return get_catalog().courses.get(course_id)
 
 
 def get_student_info(email):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     cursor = connection.execute('SELECT * FROM Students WHERE email = ?', (email,))
     result = cursor.fetchone()
     return result
 
 
 def get_professor_info(email):
-    connection = sql.connect('database.db')
+    connection = get_connection()
     cursor = connection.execute('SELECT * FROM Professors WHERE email = ?', (email,))
     result = cursor.fetchone()
     return result
 
 
 def get_user_type(email):
-    connection = sql.connect('database.db')
-
-    cursor = connection.execute('SELECT * FROM Students WHERE email = ?', (email,))
-    result = cursor.fetchone()
-    if result:
-        return "student"
-
-    cursor = connection.execute('SELECT * FROM Professors WHERE email = ?', (email,))
-    result = cursor.fetchone()
-    if result:
-        return "professor"
-
-    return None
-
-
-def get_Prof_TeachingTeams(email):
-    connection = sql.connect('database.db')
-
-    cursor = connection.execute('SELECT * FROM Prof_Teaching_Teams WHERE prof_email = ?', (email,))
-    result = cursor.fetchone()
-    return result
+    return get_viewer(email).user_type
 
 
 def get_taught_classes(email):
-    connection = sql.connect('database.db')
-
-    cursor = connection.execute('SELECT * FROM Prof_Teaching_Teams WHERE prof_email = ?', (email,))
-    result = cursor.fetchone()
-
-    if result:
-        cursor = connection.execute('SELECT * FROM Courses WHERE teaching_team_id = ?', (result[1],))
-        result = cursor.fetchall()
-        return result
-
+    viewer = get_viewer(email)
+    if viewer.prof_team is not None:
+        return list(viewer.prof_classes)
     return None
 
 
 def get_TA_classes(email):
-    connection = sql.connect('database.db')
-
-    cursor = connection.execute('SELECT * FROM TA_Teaching_Teams WHERE student_email = ?', (email,))
-    result = cursor.fetchone()
-
-    if result:
-        cursor = connection.execute('SELECT * FROM Courses WHERE teaching_team_id = ?', (result[1],))
-        result = cursor.fetchall()
-        return result
+    viewer = get_viewer(email)
+    if viewer.ta_team is not None:
+        return list(viewer.ta_classes)
+    return None
 
 
 def isEnrolled(email, classID):
-    connection = sql.connect('database.db')
-
-    cursor = connection.execute('SELECT * FROM Enrolls WHERE student_email = ? AND course_id = ?', (email, classID,))
-    result = cursor.fetchone()
-
-    return result
+    return get_student_section(email, classID)
 
 
 def dropCourse(email, course_id, sec_no):
-    connection = sql.connect('database.db')
+    connection = get_connection()
 
     cursor = connection.execute('SELECT * FROM Enrolls WHERE student_email = ? AND course_id = ? AND section_no = ?',
                                 (email, course_id, sec_no,))
@@ -954,108 +914,242 @@ def dropCourse(email, course_id, sec_no):
         currentDate = datetime.strptime("4/5/04", "%m/%d/%y")
 
         if currentDate <= dropDate:
-            # user is enrolled and within drop deadline, can drop!
-            connection.execute('DELETE FROM Enrolls WHERE student_email = ? AND course_id = ? AND section_no = ?',
-                               (email, course_id, sec_no,))
-            connection.commit()
-
-            connection.execute("DELETE FROM Posts WHERE student_email = ? AND course_id = ?", (email, course_id,))
-            connection.commit()
-
-            connection.execute("DELETE FROM Comments WHERE student_email = ? AND course_id = ?", (email, course_id,))
-            connection.commit()
+            # user is enrolled and within drop deadline, can drop! The enrollment, posts and comments go together.
+            with immediate_transaction(connection):
+                connection.execute('DELETE FROM Enrolls WHERE student_email = ? AND course_id = ? AND section_no = ?',
+                                   (email, course_id, sec_no,))
+                connection.execute("DELETE FROM Posts WHERE student_email = ? AND course_id = ?", (email, course_id,))
+                connection.execute("DELETE FROM Comments WHERE student_email = ? AND course_id = ?",
+                                   (email, course_id,))
+            forget_viewer(email)
             return True
         else:
             return False
 
 
 def getDropDate(course_id):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT * FROM Courses WHERE course_id = ?', (course_id,))
-    result = cursor.fetchone()
+    result = get_class_info(course_id)
 
     if result:
         return str(result[4])
 
 
-def get_students_in_course_section(course_id, sec_no):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT student_email FROM Enrolls WHERE course_id = ? AND section_no = ?',
-                                (course_id, sec_no,))
-    result = cursor.fetchall()
-    return result
-
-
+# Adds the next homework to a section and an empty grade row for every student enrolled in it, returning its number.
+# Numbering and the grade rows happen in one immediate transaction, so two professors adding homework at once cannot
+# be given the same number, and the grade rows are one INSERT ... SELECT however big the section is.
 def addHomework(course_id, sec_no, details):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT MAX(hw_no) FROM Homework WHERE course_id = ? AND sec_no = ?',
-                                (course_id, sec_no,))
-    result = cursor.fetchone()
-
-    if result[0]:
-        hw_no = int(result[0]) + 1
-    else:
-        hw_no = 1
-
     sec_no = int(sec_no)
 
-    connection.execute('INSERT INTO Homework (course_id, sec_no, hw_no, hw_details) VALUES (?,?,?,?);',
-                       (course_id, sec_no, hw_no, details,))
+    connection = get_connection()
+    with immediate_transaction(connection):
+        cursor = connection.execute(
+            'INSERT INTO Homework (course_id, sec_no, hw_no, hw_details) '
+            'SELECT ?, ?, COALESCE(MAX(hw_no), 0) + 1, ? FROM Homework WHERE course_id = ? AND sec_no = ?',
+            (course_id, sec_no, details, course_id, sec_no,))
+        hw_no = connection.execute('SELECT hw_no FROM Homework WHERE rowid = ?', (cursor.lastrowid,)).fetchone()[0]
 
-    connection.commit()
-
-    students = get_students_in_course_section(course_id, sec_no)
-    for student in students:
         connection.execute(
-            'INSERT INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) VALUES (?,?,?,?,?);',
-            (student[0], course_id, sec_no, hw_no, None,))
-        connection.commit()
-
+            'INSERT OR IGNORE INTO Homework_Grades (student_email, course_id, sec_no, hw_no, grade) '
+            'SELECT student_email, course_id, section_no, ?, NULL FROM Enrolls WHERE course_id = ? AND section_no = ?',
+            (hw_no, course_id, sec_no,))
 
-def addExam(course_id, sec_no, details):
-    connection = sql.connect('database.db')
-    cursor = connection.execute('SELECT MAX(exam_no) FROM Exams WHERE course_id = ? AND sec_no = ?',
-                                (course_id, sec_no,))
-    result = cursor.fetchone()
+    return hw_no
 
-    if result[0]:
-        exam_no = int(result[0]) + 1
-    else:
-        exam_no = 1
 
+# Adds the next exam to a section and an empty grade row for every student enrolled in it, returning its number.
+# Works the same way as addHomework.
+def addExam(course_id, sec_no, details):
     sec_no = int(sec_no)
 
-    connection.execute('INSERT INTO Exams (course_id, sec_no, exam_no, exam_details) VALUES (?,?,?,?);',
-                       (course_id, sec_no, exam_no, details,))
-
-    connection.commit()
+    connection = get_connection()
+    with immediate_transaction(connection):
+        cursor = connection.execute(
+            'INSERT INTO Exams (course_id, sec_no, exam_no, exam_details) '
+            'SELECT ?, ?, COALESCE(MAX(exam_no), 0) + 1, ? FROM Exams WHERE course_id = ? AND sec_no = ?',
+            (course_id, sec_no, details, course_id, sec_no,))
+        exam_no = connection.execute('SELECT exam_no FROM Exams WHERE rowid = ?', (cursor.lastrowid,)).fetchone()[0]
 
-    students = get_students_in_course_section(course_id, sec_no)
-    for student in students:
         connection.execute(
-            'INSERT INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) VALUES (?,?,?,?,?);',
-            (student[0], course_id, sec_no, exam_no, None,))
-        connection.commit()
+            'INSERT OR IGNORE INTO Exam_Grades (student_email, course_id, sec_no, exam_no, grade) '
+            'SELECT student_email, course_id, section_no, ?, NULL FROM Enrolls WHERE course_id = ? AND section_no = ?',
+            (exam_no, course_id, sec_no,))
+
+    return exam_no
 
 
 def change_hw_grade(email, class_id, sec_no, assignment_no, grade):
-    connection = sql.connect('database.db')
-    connection.execute(
-        'UPDATE Homework_Grades SET grade = ? WHERE student_email = ? AND course_id = ? AND sec_no = ? AND hw_no = ?;',
-        (grade, email, class_id, sec_no, assignment_no,))
+    connection = get_connection()
+    connection.execute(GRADE_UPDATES['homework'], (grade, email, class_id, sec_no, assignment_no,))
     connection.commit()
 
 
 def change_exam_grade(email, class_id, sec_no, assignment_no, grade):
-    connection = sql.connect('database.db')
-    connection.execute(
-        'UPDATE Exam_Grades SET grade = ? WHERE student_email = ? AND course_id = ? AND sec_no = ? AND exam_no = ?;',
-        (grade, email, class_id, sec_no, assignment_no,))
+    connection = get_connection()
+    connection.execute(GRADE_UPDATES['exam'], (grade, email, class_id, sec_no, assignment_no,))
     connection.commit()
 
 
+# How many gradebook rows are fetched from the database at a time while exporting.
+GRADEBOOK_CHUNK_ROWS = 500
+
+# A section's gradebook as a run of rows per enrolled student, ordered by email: first the student's name and grade
+# totals, worked out as in get_grade_summary, then one row per homework grade and one per exam grade.
+GRADEBOOK = (
+    'SELECT e.student_email, 0, NULL, u.name, g.hw_avg, g.exam_avg, '
+    '(COALESCE(g.hw_sum, 0) + COALESCE(g.exam_sum, 0)) * 1.0 / NULLIF(g.hw_count + g.exam_count, 0) '
+    'FROM Enrolls e LEFT JOIN User u ON u.email = e.student_email '
+    'LEFT JOIN Grade_Summary g ON g.student_email = e.student_email AND g.course_id = e.course_id '
+    'AND g.sec_no = e.section_no '
+    'WHERE e.course_id = :course_id AND e.section_no = :sec_no '
+    'UNION ALL '
+    'SELECT h.student_email, 1, h.hw_no, h.grade, NULL, NULL, NULL FROM Enrolls e JOIN Homework_Grades h '
+    'ON h.student_email = e.student_email AND h.course_id = e.course_id AND h.sec_no = e.section_no '
+    'WHERE e.course_id = :course_id AND e.section_no = :sec_no '
+    'UNION ALL '
+    'SELECT x.student_email, 2, x.exam_no, x.grade, NULL, NULL, NULL FROM Enrolls e JOIN Exam_Grades x '
+    'ON x.student_email = e.student_email AND x.course_id = e.course_id AND x.sec_no = e.section_no '
+    'WHERE e.course_id = :course_id AND e.section_no = :sec_no '
+    'ORDER BY 1, 2, 3'
+)
+
+
+# Yields a section's gradebook as CSV text, one chunk of students at a time: a column per homework and exam of the
+# section, then the homework average, exam average and total grade.
+def stream_gradebook(course_id, sec_no):
+    connection = get_connection()
+    homework = [row[0] for row in connection.execute(
+        'SELECT hw_no FROM Homework WHERE course_id = ? AND sec_no = ? ORDER BY hw_no', (course_id, sec_no,))]
+    exams = [row[0] for row in connection.execute(
+        'SELECT exam_no FROM Exams WHERE course_id = ? AND sec_no = ? ORDER BY exam_no', (course_id, sec_no,))]
+
+    # where each kind of grade goes in a student's row, after their email and name.
+    columns = {(1, hw_no): 2 + i for i, hw_no in enumerate(homework)}
+    columns.update({(2, exam_no): 2 + len(homework) + i for i, exam_no in enumerate(exams)})
+    width = 2 + len(homework) + len(exams)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Email', 'Name'] + ['HW %s' % hw_no for hw_no in homework] +
+                    ['Exam %s' % exam_no for exam_no in exams] + ['HW Average', 'Exam Average', 'Total'])
+
+    cursor = connection.execute(GRADEBOOK, {'course_id': course_id, 'sec_no': sec_no})
+    student = None
+    while True:
+        rows = cursor.fetchmany(GRADEBOOK_CHUNK_ROWS)
+        for email, kind, number, value, hw_avg, exam_avg, total in rows:
+            # each student's rows start a new CSV row, even if their summary row were ever missing.
+            if student is None or student[0] != email:
+                if student is not None:
+                    writer.writerow(student)
+                student = [email, ''] + [''] * (width - 2) + ['', '', '']
+            if kind == 0:
+                student[1] = value
+                student[width:] = [hw_avg, exam_avg, total]
+            elif (kind, number) in columns and value is not None:
+                student[columns[(kind, number)]] = value
+
+        if not rows:
+            break
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if student is not None:
+        writer.writerow(student)
+    yield buffer.getvalue()
+
+
+# Grades a professor can enter on the grading pages.
+MIN_GRADE = 0
+MAX_GRADE = 100
+
+# Sets one student's grade on one assignment of each kind.
+GRADE_UPDATES = {
+    'homework': 'UPDATE Homework_Grades SET grade = ? '
+                'WHERE student_email = ? AND course_id = ? AND sec_no = ? AND hw_no = ?',
+    'exam': 'UPDATE Exam_Grades SET grade = ? '
+            'WHERE student_email = ? AND course_id = ? AND sec_no = ? AND exam_no = ?',
+}
+
+
+# Reads the grades posted to a grading page as [(row, email, grade)], along with a report of the rows that could not
+# be read as [(row, email, reason)]. An uploaded CSV holds email,grade lines, optionally under an email,grade header.
+# Otherwise the grades come from the roster form's grade-<email> fields, skipping the ones left blank.
+def read_posted_grades():
+    rows = []
+    errors = []
+
+    upload = request.files.get('grades_csv')
+    if upload is None or not upload.filename:
+        for row, (field, grade) in enumerate(request.form.items(), 1):
+            if field.startswith('grade-') and grade.strip():
+                rows.append((row, field[len('grade-'):], grade))
+        return rows, errors
+
+    try:
+        text = upload.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return rows, [(None, upload.filename, 'file is not UTF-8 text')]
+
+    for row, line in enumerate(csv.reader(io.StringIO(text, newline='')), 1):
+        if not line or not ''.join(line).strip():
+            continue
+        if row == 1 and line[0].strip().lower() == 'email':
+            continue
+        if len(line) != 2:
+            errors.append((row, line[0].strip(), 'expected two columns, email,grade'))
+        else:
+            rows.append((row, line[0], line[1]))
+
+    return rows, errors
+
+
+# Checks posted (row, email, grade) rows against an assignment's roster of {email: current grade}.
+# Returns {email: grade} for the valid rows, adding a reason to errors for every row that was rejected.
+def validate_grades(rows, roster, errors):
+    valid = {}
+    for row, email, grade in rows:
+        email = email.strip()
+        grade = grade.strip()
+        if email not in roster:
+            errors.append((row, email, 'not a student in this section'))
+        elif email in valid:
+            errors.append((row, email, 'listed more than once'))
+        elif not grade.isdigit() or not MIN_GRADE <= int(grade) <= MAX_GRADE:
+            errors.append((row, email, 'grade must be a whole number from %d to %d' % (MIN_GRADE, MAX_GRADE)))
+        else:
+            valid[email] = int(grade)
+    return valid
+
+
+# Applies a batch of posted grades to one assignment of a kind ('homework' or 'exam') in a single transaction,
+# given the assignment's current grade rows. Grades that did not change are not written.
+# Returns (number of grades changed, [(row, email, reason)] for the rows that were rejected).
+def grade_batch(kind, class_id, sec_no, assignment_no, grades):
+    roster = {grade_row[0]: grade_row[4] for grade_row in grades}
+    rows, errors = read_posted_grades()
+    valid = validate_grades(rows, roster, errors)
+
+    changed = [(grade, email, class_id, sec_no, assignment_no) for email, grade in valid.items()
+               if grade != roster[email]]
+    if changed:
+        connection = get_connection()
+        with immediate_transaction(connection):
+            connection.executemany(GRADE_UPDATES[kind], changed)
+
+    return len(changed), errors
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
-    print("Populating DB")
-    populate()
+    from PopulateScript import ensure_populated
+
+    # Only rebuilds the database when the CSVs or schema changed since it was last built.
+    # Set NITTANYPATH_SNAPSHOT to a prebuilt database to boot from that instead.
+    ensure_populated(snapshot=os.environ.get('NITTANYPATH_SNAPSHOT'))
     print("Done!")
+
+    # The development server. In production run gunicorn instead, see gunicorn.conf.py.
     app.run(port=5000, threaded=True, host=('0.0.0.0'))
@@ -0,0 +1,708 @@
+import argparse
+import csv
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3 as sql
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+from contextlib import nullcontext
+from random import Random
+from time import perf_counter, sleep
+from urllib.parse import quote, urlencode
+
+# benchmarks.py holds the stress tests and benchmarks for the app, run from the src directory:
+#
+#   python benchmarks.py enroll-stress [--threads N] [--students N] [--seats N]
+#   python benchmarks.py assignment-fanout [--sizes N,N,...] [--repeat N]
+#   python benchmarks.py gradebook-export [--sizes N,N,...] [--homework N] [--exams N]
+#   python benchmarks.py login-throughput [--threads N] [--logins N] [--scrypt-n N,N,...] [--pbkdf2-iterations N,...]
+#   python benchmarks.py cold-start [--runs N]
+#   python benchmarks.py scale-data --out DIR [--students N] [--courses N] [--posts N] [--seed N]
+#   python benchmarks.py load-test [--database PATH] [--threads N] [--requests N] [--users N] [--seed N]
+#   python benchmarks.py serve-throughput [--database PATH] [--cores N,N,...] [--workers N] [--clients N] [--requests N]
+#
+# Each one works on a scratch copy of database.db, so the real database is never touched.
+
+
+# Copies database.db to a temporary file and points the app at it. Must run before app is imported.
+def use_scratch_database(source='database.db'):
+    directory = tempfile.mkdtemp(prefix='nittanypath-bench-')
+    path = os.path.join(directory, 'database.db')
+    source = sql.connect(source)
+    target = sql.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+
+    os.environ['NITTANYPATH_DB'] = path
+    return path
+
+
+# Adds students that are not enrolled in anything, returning their emails.
+def add_students(connection, count, prefix='bench'):
+    emails = ['%s%d@nittany.edu' % (prefix, i) for i in range(count)]
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO User (email, name) VALUES (?, ?)',
+                               [(email, email) for email in emails])
+        connection.executemany('INSERT OR IGNORE INTO Students (email) VALUES (?)', [(email,) for email in emails])
+    return emails
+
+
+# Runs work(item) for every item across the given number of threads, each inside its own app context unless app is
+# None, all starting at the same moment. Returns the results in item order.
+def run_concurrently(app, items, threads, work):
+    results = [None] * len(items)
+    barrier = threading.Barrier(threads)
+
+    def worker(offset):
+        barrier.wait()
+        for i in range(offset, len(items), threads):
+            with app.app_context() if app is not None else nullcontext():
+                results[i] = work(items[i])
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return results
+
+
+# Has many students race to enroll in one small section, then checks it was not overbooked and that its seat
+# counter matches the real number of enrollments.
+def enroll_stress(args):
+    use_scratch_database()
+    from app import app, enrollUser
+
+    connection = sql.connect(os.environ['NITTANYPATH_DB'])
+    emails = add_students(connection, args.students)
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO Courses (course_id, course_name) VALUES ('BENCH100', 'Bench')")
+        connection.execute("INSERT OR REPLACE INTO Sections (course_id, sec_no, max_limit) VALUES ('BENCH100', 1, ?)",
+                           (args.seats,))
+
+    start = perf_counter()
+    results = run_concurrently(app, emails, args.threads, lambda email: enrollUser(email, 'BENCH100', 1))
+    elapsed = perf_counter() - start
+
+    enrolled = connection.execute("SELECT COUNT(*) FROM Enrolls WHERE course_id = 'BENCH100'").fetchone()[0]
+    counter = connection.execute("SELECT enrolled_count FROM Sections WHERE course_id = 'BENCH100'").fetchone()[0]
+    accepted = sum(1 for result in results if result)
+
+    print("%d students, %d threads, %d seats: %d enrolled in %.3fs (%.0f attempts/sec)"
+          % (args.students, args.threads, args.seats, enrolled, elapsed, args.students / elapsed))
+    print("accepted %d, enrolled_count %d, overbooked by %d" % (accepted, counter, max(enrolled - args.seats, 0)))
+
+    return enrolled == min(args.seats, args.students) == accepted == counter
+
+
+# Times creating homework and exams in sections of growing size. Creation is one transaction whatever the size, so
+# the cost per enrolled student should stay flat instead of growing with a round trip per student.
+def assignment_fanout(args):
+    use_scratch_database()
+    from app import app, addHomework, addExam
+
+    connection = sql.connect(os.environ['NITTANYPATH_DB'])
+    sizes = [int(size) for size in args.sizes.split(',')]
+    emails = add_students(connection, max(sizes))
+
+    print("%10s %14s %14s %18s" % ('students', 'homework ms', 'exam ms', 'us per student'))
+    for n, size in enumerate(sizes):
+        course_id = 'BENCH%d' % n
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO Courses (course_id, course_name) VALUES (?, ?)',
+                               (course_id, course_id))
+            connection.execute('INSERT OR REPLACE INTO Sections (course_id, sec_no, max_limit) VALUES (?, 1, ?)',
+                               (course_id, size))
+            connection.executemany('INSERT INTO Enrolls (student_email, course_id, section_no) VALUES (?, ?, 1)',
+                                   [(email, course_id) for email in emails[:size]])
+
+        timings = []
+        for add in (addHomework, addExam):
+            with app.app_context():
+                start = perf_counter()
+                for i in range(args.repeat):
+                    add(course_id, 1, 'bench %d' % i)
+                timings.append((perf_counter() - start) / args.repeat * 1000)
+
+        print("%10d %14.2f %14.2f %18.1f" % (size, timings[0], timings[1], sum(timings) / 2 / size * 1000))
+
+
+# Exports the gradebook of sections of growing size, tracking the memory the export itself allocates. The export
+# streams in chunks, so its peak should stay about the same however many students the section has.
+def gradebook_export(args):
+    use_scratch_database()
+    from app import app, addHomework, addExam, stream_gradebook
+
+    connection = sql.connect(os.environ['NITTANYPATH_DB'])
+    sizes = [int(size) for size in args.sizes.split(',')]
+    emails = add_students(connection, max(sizes))
+
+    print("%10s %12s %12s %14s" % ('students', 'seconds', 'bytes out', 'peak KiB'))
+    for n, size in enumerate(sizes):
+        course_id = 'BENCH%d' % n
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO Courses (course_id, course_name) VALUES (?, ?)',
+                               (course_id, course_id))
+            connection.execute('INSERT OR REPLACE INTO Sections (course_id, sec_no, max_limit) VALUES (?, 1, ?)',
+                               (course_id, size))
+            connection.executemany('INSERT INTO Enrolls (student_email, course_id, section_no) VALUES (?, ?, 1)',
+                                   [(email, course_id) for email in emails[:size]])
+
+        with app.app_context():
+            for i in range(args.homework):
+                addHomework(course_id, 1, 'bench %d' % i)
+            for i in range(args.exams):
+                addExam(course_id, 1, 'bench %d' % i)
+        with connection:
+            connection.execute("UPDATE Homework_Grades SET grade = abs(random()) % 101 WHERE course_id = ?",
+                               (course_id,))
+            connection.execute("UPDATE Exam_Grades SET grade = abs(random()) % 101 WHERE course_id = ?",
+                               (course_id,))
+
+        with app.app_context():
+            tracemalloc.start()
+            start = perf_counter()
+            written = sum(len(chunk) for chunk in stream_gradebook(course_id, 1))
+            elapsed = perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        print("%10d %12.3f %12d %14.1f" % (size, elapsed, written, peak / 1024))
+
+
+# Logs users in through the login page from many threads at once, for each password hashing cost, to show what each
+# cost does to login throughput. Legacy MD4 hashes are timed too, with the first login that upgrades them.
+def login_throughput(args):
+    use_scratch_database()
+    import passwords
+    from app import app
+
+    connection = sql.connect(os.environ['NITTANYPATH_DB'])
+    emails = add_students(connection, args.logins)
+
+    hashers = [('scrypt', 'n=%d' % n, passwords.ScryptHasher(n=n))
+               for n in (int(n) for n in args.scrypt_n.split(',') if n)]
+    hashers += [('pbkdf2_sha256', 'iterations=%d' % n, passwords.PBKDF2Hasher(iterations=n))
+                for n in (int(n) for n in args.pbkdf2_iterations.split(',') if n)]
+
+    def log_in(email):
+        response = app.test_client().post('/login/', data={'loginEmail': email, 'loginPassword': 'bench'})
+        return response.status_code == 302
+
+    print("%-14s %-18s %-14s %12s %12s" % ('hasher', 'cost', 'stored', 'logins/sec', 'ms/login'))
+    for name, cost, hasher in hashers:
+        passwords.hasher = hasher
+        passwords.HASHERS[hasher.algorithm] = hasher
+        del passwords._throwaway[:]
+
+        for stored, encoded in (('md4', passwords.MD4Hasher().encode('bench')), (name, hasher.encode('bench'))):
+            with connection:
+                connection.executemany('UPDATE User SET password_hashed = ? WHERE email = ?',
+                                       [(encoded, email) for email in emails])
+
+            start = perf_counter()
+            results = run_concurrently(app, emails, args.threads, log_in)
+            elapsed = perf_counter() - start
+
+            if not all(results):
+                print("%d of %d logins failed" % (results.count(False), len(results)))
+                return False
+            print("%-14s %-18s %-14s %12.1f %12.1f"
+                  % (name, cost, stored, len(emails) / elapsed, elapsed / len(emails) * args.threads * 1000))
+
+
+# Run in a new interpreter by cold_start: imports the app, then serves one logged in dashboard request.
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['_user_id'] = sys.argv[1]
+status = client.get('/dashboard').status_code
+answered = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_response': answered - imported, 'status': status,
+                  'pandas': 'pandas' in sys.modules}))
+"""
+
+
+# Starts the app in a new interpreter several times, timing the import of app.py and its first response, and the
+# whole process from launch to exit.
+def cold_start(args):
+    path = use_scratch_database()
+    from migrations import migrate
+
+    connection = sql.connect(path)
+    migrate(connection)
+    email = connection.execute('SELECT email FROM Students LIMIT 1').fetchone()[0]
+    connection.close()
+
+    runs = []
+    for n in range(args.runs):
+        start = perf_counter()
+        output = subprocess.run([sys.executable, '-c', COLD_START, email], check=True, capture_output=True,
+                                text=True).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        run['process'] = perf_counter() - start
+        runs.append(run)
+
+    print("%d runs, medians:" % args.runs)
+    for key, label in (('import', 'import app'), ('first_response', 'first response'), ('process', 'whole process')):
+        print("  %-16s %8.1f ms" % (label, statistics.median(run[key] for run in runs) * 1000))
+    print("  pandas imported  %s" % any(run['pandas'] for run in runs))
+
+    return all(run['status'] == 200 for run in runs)
+
+
+# What the synthetic data is made of.
+FIRST_NAMES = ('Alisa', 'Abel', 'Arlie', 'Bryce', 'Carmen', 'Dana', 'Elias', 'Fern', 'Gus', 'Hana', 'Ivo', 'Jun',
+               'Kira', 'Lev', 'Mara', 'Nico', 'Omar', 'Pia', 'Quinn', 'Rosa', 'Sol', 'Tess', 'Uma', 'Wes')
+LAST_NAMES = ('Adams', 'Anderson', 'Baker', 'Chen', 'Diaz', 'Evans', 'Garcia', 'Hughes', 'Kim', 'Lynch', 'Murray',
+              'Nguyen', 'Owens', 'Patel', 'Reyes', 'Singh', 'Stracke', 'Turner', 'Walsh', 'Wood')
+SUBJECTS = ('CMPSC', 'CMPEN', 'CSE', 'EE', 'IST', 'MATH', 'PHYS', 'CHEM', 'STAT', 'ENGL')
+TOPICS = ('Introduction to', 'Advanced', 'Foundations of', 'Topics in', 'Principles of', 'Applied')
+FIELDS = ('Computer Vision', 'Databases', 'Signal Processing', 'Network Security', 'Algorithms', 'Statistics',
+          'Mechanics', 'Cryptography', 'Linear Algebra', 'Organic Chemistry', 'Operating Systems', 'Compilers',
+          'Information Technology', 'Technical Writing', 'Circuits', 'Machine Learning')
+PLACES = (('Carbondale', 'Illinois'), ('Schneider', 'Indiana'), ('State College', 'Pennsylvania'),
+          ('Altoona', 'Pennsylvania'), ('Columbus', 'Ohio'), ('Ithaca', 'New York'), ('Newark', 'Delaware'))
+
+STUDENT_COLUMNS = ['Full Name', 'Email', 'Age', 'Zip', 'Phone', 'Gender', 'City', 'State', 'Password', 'Street',
+                   'Major']
+COURSE_COLUMNS = ['Courses %d', 'Course %d Name', 'Course %d Details', 'Course %d Section', 'Course %d Section Limit',
+                  'Course %d HW_No', 'Course %d HW_Details', 'Course %d HW_Grade', 'Course %d EXAM_No',
+                  'Course %d Exam_Details', 'Course %d EXAM_Grade']
+PROFESSOR_COLUMNS = ['Name', 'Email', 'Password', 'Age', 'Gender', 'Department', 'Office', 'Department Name', 'Title',
+                     'Teaching Team ID', 'Teaching']
+POST_COLUMNS = ['Courses', 'Drop Deadline', 'Post 1', 'Post 1 By', 'Comment 1', 'Comment 1 By']
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+# Writes Students_TA.csv, Professors.csv and Posts_Comments.csv of any size into args.out, in the same shape as the
+# bundled files, then populates args.out/database.db from them. The same seed always gives the same data.
+# Posts_Comments.csv only has room for one post and comment per course, so the rest of the posts and comments are
+# inserted into the database directly.
+def scale_data(args):
+    from PopulateScript import populate
+
+    random = Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    sections = args.sections
+    seats = max(10, args.students * 3 * 3 // (args.courses * sections * 2))
+
+    courses = []
+    for n in range(args.courses):
+        subject = SUBJECTS[n % len(SUBJECTS)]
+        courses.append(('%s%d' % (subject, 100 + n // len(SUBJECTS)), subject,
+                        '%s %s' % (random.choice(TOPICS), random.choice(FIELDS))))
+
+    zipcodes = [(10000 + n * 7,) + random.choice(PLACES) for n in range(500)]
+    students = []
+    for n in range(args.students):
+        zipcode, city, state = random.choice(zipcodes)
+        row = ['%s %s' % (random.choice(FIRST_NAMES), random.choice(LAST_NAMES)), 's%d@nittany.edu' % n,
+               random.randint(18, 30), zipcode, random.randint(10 ** 9, 10 ** 10 - 1), random.choice('MF'), city,
+               state, 'pw%d' % n, '%d College Ave.' % random.randint(1, 999), random.choice(SUBJECTS)]
+        for course_id, subject, name in (courses[i] for i in random.sample(range(len(courses)), 3)):
+            row += [course_id, name, '3 Credit Course.', float(random.randint(1, sections)), seats,
+                    1.0, 'Turn in this homework online!', float(random.randint(50, 100)),
+                    1.0, 'Closed book exam for 100 marks', float(random.randint(50, 100))]
+        row.append(random.randint(1, len(courses)) if n % args.ta_every == 0 else '')
+        students.append(row)
+
+    header = STUDENT_COLUMNS + [column % n for n in (1, 2, 3) for column in COURSE_COLUMNS] + ['Teaching Team ID']
+    write_csv(os.path.join(args.out, 'Students_TA.csv'), header, students)
+
+    heads = set()
+    professors = []
+    for n, (course_id, subject, name) in enumerate(courses):
+        title = 'Professor' if subject in heads else 'Head'
+        heads.add(subject)
+        professors.append(['Dr %s %s' % (random.choice(FIRST_NAMES), random.choice(LAST_NAMES)),
+                           'p%d@nittany.edu' % n, 'pw%d' % n, random.randint(35, 70), random.choice('MF'), subject,
+                           '%d, Building %d' % (random.randint(100, 400), random.randint(1, 30)),
+                           '%s Department' % subject, title, n + 1, course_id])
+    write_csv(os.path.join(args.out, 'Professors.csv'), PROFESSOR_COLUMNS, professors)
+
+    posts = []
+    for course_id, subject, name in courses:
+        posts.append([course_id, '11/21/19', 'Homework 1 for %s?' % course_id, random.choice(students)[1],
+                      'I also have the same question.', random.choice(students)[1]])
+    write_csv(os.path.join(args.out, 'Posts_Comments.csv'), POST_COLUMNS, posts)
+
+    path = os.path.join(args.out, 'database.db')
+    if os.path.exists(path):
+        os.remove(path)
+    populate(path, source=args.out)
+
+    # The rest of the posts, spread over random courses, each with about comments_per_post comments.
+    next_post = {course[0]: 2 for course in courses}
+    extra_posts = []
+    extra_comments = []
+    for n in range(max(args.posts - len(courses), 0)):
+        course_id = random.choice(courses)[0]
+        post_no = next_post[course_id]
+        next_post[course_id] += 1
+        extra_posts.append((course_id, post_no, random.choice(students)[1], 'Question %d about %s' % (n, course_id)))
+        for comment_no in range(1, random.randint(0, 2 * args.comments_per_post) + 1):
+            extra_comments.append((course_id, post_no, comment_no, random.choice(students)[1], 'Reply %d' % comment_no))
+
+    connection = sql.connect(path)
+    start = perf_counter()
+    with connection:
+        connection.executemany('INSERT INTO Posts (course_id, post_no, student_email, post_content) VALUES (?,?,?,?)',
+                               extra_posts)
+        connection.executemany('INSERT INTO Comments (course_id, post_no, comment_no, student_email, comment_content) '
+                               'VALUES (?,?,?,?,?)', extra_comments)
+    print("%-20s %7d posts and %d comments in %.3fs" % ('Posts (extra)', len(extra_posts), len(extra_comments),
+                                                          perf_counter() - start))
+    connection.close()
+    print("Wrote %s" % path)
+
+
+# Builds the requests a load test sends, as (name, email, method, url, form data), from the users and courses in the
+# database. weights decides how often each kind of request comes up.
+LOAD_TEST_WEIGHTS = {
+    'dashboard': 20, 'class-info': 15, 'posts': 15, 'new-post': 5, 'class-search': 15, 'enroll': 5,
+    'professor-dashboard': 5, 'grade-page': 10, 'grade-entry': 5, 'gradebook': 5,
+}
+
+
+def plan_requests(connection, random, count, users):
+    enrolled = connection.execute('SELECT student_email, course_id, section_no FROM Enrolls').fetchall()
+    enrolled = random.sample(enrolled, min(users, len(enrolled)))
+    sections = connection.execute('SELECT course_id, sec_no FROM Sections').fetchall()
+    assignments = connection.execute(
+        'SELECT p.prof_email, h.course_id, h.sec_no, h.hw_no FROM Prof_Teaching_Teams p '
+        'JOIN Courses c ON c.teaching_team_id = p.teaching_team_id '
+        'JOIN Homework h ON h.course_id = c.course_id').fetchall()
+    assignments = random.sample(assignments, min(users, len(assignments)))
+    words = [word for (name,) in connection.execute('SELECT course_name FROM Courses LIMIT 200')
+             for word in name.split() if len(word) > 3]
+
+    kinds = list(LOAD_TEST_WEIGHTS)
+    plan = []
+    for kind in random.choices(kinds, [LOAD_TEST_WEIGHTS[kind] for kind in kinds], k=count):
+        email, course_id, sec_no = random.choice(enrolled)
+        professor, taught, taught_section, hw_no = random.choice(assignments)
+
+        if kind == 'dashboard':
+            plan.append((kind, email, 'GET', '/dashboard', None))
+        elif kind == 'class-info':
+            plan.append((kind, email, 'GET', '/classInfo/%s' % course_id, None))
+        elif kind == 'posts':
+            plan.append((kind, email, 'GET', '/classInfo/%s/Posts' % course_id, None))
+        elif kind == 'new-post':
+            plan.append((kind, email, 'POST', '/classInfo/%s/Posts' % course_id, {'PostTextArea': 'load test'}))
+        elif kind == 'class-search':
+            query = random.choice(words + [''])
+            plan.append((kind, email, 'GET', '/classSearch?q=%s&page=%d' % (quote(query), random.randint(1, 3)), None))
+        elif kind == 'enroll':
+            course_id, sec_no = random.choice(sections)
+            plan.append((kind, email, 'POST', '/classInfo/%s/Enroll/%s' % (course_id, sec_no), None))
+        elif kind == 'professor-dashboard':
+            plan.append((kind, professor, 'GET', '/dashboard', None))
+        elif kind == 'grade-page':
+            plan.append((kind, professor, 'GET', '/classInfo/%s/Assignments/%s/%s' % (taught, taught_section, hw_no),
+                         None))
+        elif kind == 'grade-entry':
+            student = connection.execute(
+                'SELECT student_email FROM Homework_Grades WHERE course_id = ? AND sec_no = ? AND hw_no = ? LIMIT 1',
+                (taught, taught_section, hw_no)).fetchone()
+            plan.append((kind, professor, 'POST', '/classInfo/%s/Assignments/%s/%s' % (taught, taught_section, hw_no),
+                         {'grade button': student[0] if student else '', 'gradeToChange': random.randint(0, 100)}))
+        elif kind == 'gradebook':
+            plan.append((kind, professor, 'GET', '/classInfo/%s/Gradebook/%s' % (taught, taught_section), None))
+
+    return plan
+
+
+# The value below which p percent of the sorted values fall.
+def percentile(values, p):
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# Drives the real routes through the Flask test client from many threads against a scratch copy of a database,
+# by default the bundled one, or one made by scale-data. Reports latency percentiles, throughput and how many SQL
+# statements each kind of request ran, and fails if any request errored.
+def load_test(args):
+    use_scratch_database(args.database)
+    from sqlalchemy import event
+    from app import app
+    from database import db
+
+    connection = sql.connect(os.environ['NITTANYPATH_DB'])
+    plan = plan_requests(connection, Random(args.seed), args.warmup + args.requests, args.users)
+    connection.close()
+
+    # Every statement a pooled connection runs is counted against the request running on that thread.
+    counter = threading.local()
+
+    def count_statement(statement):
+        counter.statements += 1
+
+    def trace_statements(dbapi_connection, connection_record):
+        dbapi_connection.set_trace_callback(count_statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', trace_statements)
+
+    def send(item):
+        kind, email, method, url, data = item
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = email
+            session['_fresh'] = True
+
+        counter.statements = 0
+        start = perf_counter()
+        response = client.open(url, method=method, data=data)
+        response.get_data()
+        return kind, response.status_code, perf_counter() - start, counter.statements
+
+    run_concurrently(app, plan[:args.warmup], 1, send)
+    start = perf_counter()
+    results = run_concurrently(app, plan[args.warmup:], args.threads, send)
+    elapsed = perf_counter() - start
+
+    print("%-20s %7s %7s %9s %9s %9s %11s" % ('request', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+                                              'statements'))
+    for kind in sorted({result[0] for result in results}) + [None]:
+        chosen = [result for result in results if kind is None or result[0] == kind]
+        latencies = sorted(result[2] * 1000 for result in chosen)
+        errors = sum(1 for result in chosen if result[1] >= 500)
+        statements = sum(result[3] for result in chosen) / len(chosen)
+        print("%-20s %7d %7d %9.2f %9.2f %9.2f %11.1f"
+              % (kind or 'all', len(chosen), errors, percentile(latencies, 50), percentile(latencies, 95),
+                 percentile(latencies, 99), statements))
+
+    print("%d requests on %d threads in %.2fs: %.1f requests/sec"
+          % (len(results), args.threads, elapsed, len(results) / elapsed))
+
+    return not any(result[1] >= 500 for result in results)
+
+
+# Run in a new interpreter by serve_throughput: the development server, as python app.py starts it.
+DEV_SERVER = """
+import sys
+from app import app
+app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+
+
+# Returns a port nothing is listening on.
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+# Waits until a server accepts connections on port, failing if its process exits first.
+def wait_for_server(process, port, seconds=60):
+    deadline = perf_counter() + seconds
+    while perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited with status %d' % process.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError('server did not start on port %d' % port)
+
+
+# Sends one planned request over a new HTTP connection, logged in through a session cookie signed with the server's
+# key. Returns (kind, status, seconds).
+def send_http(port, cookies, item):
+    kind, email, method, url, data = item
+    body = urlencode(data) if data else None
+    headers = {'Cookie': 'session=' + cookies[email]}
+    if body:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    start = perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = 599
+    finally:
+        connection.close()
+    return kind, status, perf_counter() - start
+
+
+# Serves the same mix of requests as load-test over real HTTP, from the development server that python app.py runs
+# and from gunicorn, each pinned to 1, 2, 4... cores, and compares their throughput. Each run gets a fresh scratch copy
+# of the database. Where the machine has cores to spare, the client threads run on the cores the server was not given.
+def serve_throughput(args):
+    if importlib.util.find_spec('gunicorn') is None:
+        print("gunicorn is not installed, pip install -r requirements.txt first")
+        return False
+
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+    from migrations import migrate
+
+    connection = sql.connect(args.database)
+    plan = plan_requests(connection, Random(args.seed), args.warmup + args.requests, args.users)
+    connection.close()
+
+    secret = os.urandom(16).hex()
+    signer = Flask('benchmarks')
+    signer.secret_key = secret
+    serializer = SecureCookieSessionInterface().get_signing_serializer(signer)
+    cookies = {email: serializer.dumps({'_user_id': email, '_fresh': True}) for kind, email, *rest in plan}
+
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = None
+        print("cannot pin processes to cores here, every run uses the whole machine")
+
+    servers = [('app.run', lambda port: [sys.executable, '-c', DEV_SERVER, str(port)]),
+               ('gunicorn', lambda port: [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                                          '--bind', '127.0.0.1:%d' % port, 'app:app'])]
+
+    print("%-10s %6s %8s %8s %7s %10s %9s %9s %9s" % ('server', 'cores', 'workers', 'requests', 'errors', 'req/sec',
+                                                      'p50 ms', 'p95 ms', 'p99 ms'))
+    ok = True
+    for count in [int(count) for count in args.cores.split(',')]:
+        if cores is not None and count > len(cores):
+            print("%-10s %6d skipped, only %d cores available" % ('', count, len(cores)))
+            continue
+        server_cores = cores[:count] if cores is not None else None
+
+        for name, command in servers:
+            path = use_scratch_database(args.database)
+            connection = sql.connect(path)
+            migrate(connection)
+            connection.close()
+
+            environment = dict(os.environ, NITTANYPATH_SECRET_KEY=secret, NITTANYPATH_POPULATE='0')
+            if args.workers:
+                environment['NITTANYPATH_WORKERS'] = str(args.workers)
+            workers = 1 if name == 'app.run' else args.workers or 2 * count + 1
+
+            port = free_port()
+            pin = (lambda: os.sched_setaffinity(0, server_cores)) if server_cores else None
+            process = subprocess.Popen(command(port), env=environment, preexec_fn=pin, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(process, port)
+                if cores is not None and len(cores) > count:
+                    os.sched_setaffinity(0, cores[count:])
+
+                send = lambda item: send_http(port, cookies, item)
+                run_concurrently(None, plan[:args.warmup], args.clients, send)
+                start = perf_counter()
+                results = run_concurrently(None, plan[args.warmup:], args.clients, send)
+                elapsed = perf_counter() - start
+            finally:
+                if cores is not None:
+                    os.sched_setaffinity(0, cores)
+                process.terminate()
+                process.wait()
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+            latencies = sorted(result[2] * 1000 for result in results)
+            errors = sum(1 for result in results if result[1] >= 500)
+            ok = ok and not errors
+            print("%-10s %6d %8d %8d %7d %10.1f %9.2f %9.2f %9.2f"
+                  % (name, count, workers, len(results), errors, len(results) / elapsed, percentile(latencies, 50),
+                     percentile(latencies, 95), percentile(latencies, 99)))
+
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='NittanyPath stress tests and benchmarks.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('enroll-stress', help='race students for the seats of one section')
+    command.add_argument('--threads', type=int, default=32)
+    command.add_argument('--students', type=int, default=500)
+    command.add_argument('--seats', type=int, default=50)
+    command.set_defaults(run=enroll_stress)
+
+    command = commands.add_parser('assignment-fanout', help='time creating assignments as sections grow')
+    command.add_argument('--sizes', default='10,100,300,1000,3000')
+    command.add_argument('--repeat', type=int, default=5)
+    command.set_defaults(run=assignment_fanout)
+
+    command = commands.add_parser('gradebook-export', help='time and measure streaming section gradebooks')
+    command.add_argument('--sizes', default='30,300,3000')
+    command.add_argument('--homework', type=int, default=10)
+    command.add_argument('--exams', type=int, default=3)
+    command.set_defaults(run=gradebook_export)
+
+    command = commands.add_parser('login-throughput', help='log users in concurrently at each password hashing cost')
+    command.add_argument('--threads', type=int, default=16)
+    command.add_argument('--logins', type=int, default=64)
+    command.add_argument('--scrypt-n', default='4096,16384,32768')
+    command.add_argument('--pbkdf2-iterations', default='100000,600000')
+    command.set_defaults(run=login_throughput)
+
+    command = commands.add_parser('cold-start', help='time importing the app and serving its first request')
+    command.add_argument('--runs', type=int, default=5)
+    command.set_defaults(run=cold_start)
+
+    command = commands.add_parser('scale-data', help='generate a larger dataset and database of the same shape')
+    command.add_argument('--out', required=True)
+    command.add_argument('--students', type=int, default=100000)
+    command.add_argument('--courses', type=int, default=2000)
+    command.add_argument('--sections', type=int, default=2)
+    command.add_argument('--posts', type=int, default=1000000)
+    command.add_argument('--comments-per-post', type=int, default=1)
+    command.add_argument('--ta-every', type=int, default=50)
+    command.add_argument('--seed', type=int, default=1)
+    command.set_defaults(run=scale_data)
+
+    command = commands.add_parser('load-test', help='drive the routes from many threads and report latencies')
+    command.add_argument('--database', default='database.db')
+    command.add_argument('--threads', type=int, default=16)
+    command.add_argument('--requests', type=int, default=2000)
+    command.add_argument('--warmup', type=int, default=100)
+    command.add_argument('--users', type=int, default=200)
+    command.add_argument('--seed', type=int, default=1)
+    command.set_defaults(run=load_test)
+
+    command = commands.add_parser('serve-throughput', help='compare app.run and gunicorn over HTTP across core counts')
+    command.add_argument('--database', default='database.db')
+    command.add_argument('--cores', default='1,2,4')
+    command.add_argument('--workers', type=int, default=0)
+    command.add_argument('--clients', type=int, default=16)
+    command.add_argument('--requests', type=int, default=2000)
+    command.add_argument('--warmup', type=int, default=100)
+    command.add_argument('--users', type=int, default=200)
+    command.add_argument('--seed', type=int, default=1)
+    command.set_defaults(run=serve_throughput)
+
+    args = parser.parse_args(argv)
+    return 0 if args.run(args) is not False else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sys.exit(main())
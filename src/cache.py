@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+# A sentinel for "not in the cache", since None is a value worth caching.
+MISSING = object()
+
+
+# A thread safe, size bounded cache whose entries also expire after ttl seconds.
+# When full, the least recently used entry is dropped to make room.
+# Hits, misses and evictions are counted so the size and ttl can be tuned.
+class LRUCache:
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return MISSING
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
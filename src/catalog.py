@@ -0,0 +1,116 @@
+import os
+
+from threading import Lock
+from time import monotonic
+
+from database import open_connection
+
+# catalog.py keeps the reference data that only changes a few times a semester in memory: courses, their sections,
+# the professor of each teaching team and zipcodes. Reading it never touches the database.
+#
+# The data is held in a Catalog, which is never changed once built. When the data changes a new Catalog is built and
+# swapped in whole, so a request always sees one consistent snapshot, even if it keeps using the old one.
+# At most every NITTANYPATH_CATALOG_CHECK_SECONDS, a read checks PRAGMA data_version on the catalog's own connection,
+# which only changes after another connection commits. Only then is the catalog version in Page_Versions read, which
+# triggers bump on every write to the reference tables (see migrations.py), and the catalog rebuilt if it moved.
+
+CHECK_SECONDS = float(os.environ.get('NITTANYPATH_CATALOG_CHECK_SECONDS', 1))
+
+
+# One snapshot of the reference data, as the same tuples the tables hold.
+class Catalog:
+
+    def __init__(self, version, changed_at, courses, sections, professors, zipcodes):
+        self.version = version
+        self.changed_at = changed_at
+        # every Courses row by course id, and all of them in course id order
+        self.courses = {course[0]: course for course in courses}
+        self.course_list = tuple(courses)
+        # each course's sections as (course_id, sec_no, max_limit), in section order. Seat counts change with every
+        # enrollment, so they are not kept here.
+        self.sections = {}
+        for section in sections:
+            self.sections.setdefault(section[0], []).append(section)
+        self.sections = {course_id: tuple(rows) for course_id, rows in self.sections.items()}
+        # the Professors row of each teaching team's professor
+        self.professors = {}
+        for team, *professor in professors:
+            self.professors.setdefault(team, tuple(professor))
+        self.zipcodes = {zipcode[0]: zipcode for zipcode in zipcodes}
+
+    # Zipcodes are stored as integers, but may be asked for as text.
+    def zipcode(self, zipcode):
+        try:
+            return self.zipcodes.get(int(zipcode))
+        except (TypeError, ValueError):
+            return None
+
+
+# The current Catalog, and when it is next checked against the database.
+current = None
+next_check = 0.0
+
+# Held by the one thread checking or loading the catalog. Other threads go on with the current one meanwhile.
+check_lock = Lock()
+
+# The connection catalogs are checked and loaded with, and the process it was opened in, since a connection must not
+# be used across a fork. Only used under check_lock.
+connection = None
+connection_pid = None
+data_version = None
+
+
+def catalog_connection():
+    global connection, connection_pid
+    if connection_pid != os.getpid():
+        connection = open_connection()
+        connection_pid = os.getpid()
+    return connection
+
+
+# Returns the catalog's (version, changed_at) from Page_Versions.
+def catalog_version(connection):
+    cursor = connection.execute(
+        "SELECT version, changed_at FROM Page_Versions WHERE scope = 'catalog' AND course_id = ''")
+    return cursor.fetchone() or (0, 0)
+
+
+def load(connection):
+    return Catalog(
+        *catalog_version(connection),
+        connection.execute('SELECT * FROM Courses ORDER BY course_id').fetchall(),
+        connection.execute('SELECT course_id, sec_no, max_limit FROM Sections ORDER BY course_id, sec_no').fetchall(),
+        connection.execute('SELECT t.teaching_team_id, p.* FROM Prof_Teaching_Teams t '
+                           'JOIN Professors p ON p.email = t.prof_email '
+                           'ORDER BY t.teaching_team_id, p.email').fetchall(),
+        connection.execute('SELECT * FROM Zipcodes').fetchall())
+
+
+# Builds a new catalog if the reference data changed since the current one was built, or if there is none yet.
+def refresh():
+    global current, data_version, next_check
+    connection = catalog_connection()
+
+    # the catalog's reads are one transaction, so the snapshot is consistent
+    connection.execute('BEGIN')
+    try:
+        seen = connection.execute('PRAGMA data_version').fetchone()[0]
+        if current is None or (seen != data_version and catalog_version(connection)[0] != current.version):
+            current = load(connection)
+        data_version = seen
+    finally:
+        connection.rollback()
+    next_check = monotonic() + CHECK_SECONDS
+
+
+# Returns the current catalog, loading it on first use. A thread that finds it due for a check does the check, unless
+# another already is, in which case it uses the current catalog rather than wait.
+def get_catalog():
+    if current is None or monotonic() >= next_check:
+        if check_lock.acquire(blocking=current is None):
+            try:
+                if current is None or monotonic() >= next_check:
+                    refresh()
+            finally:
+                check_lock.release()
+    return current
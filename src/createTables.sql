@@ -165,3 +165,10 @@ CREATE TABLE IF NOT EXISTS Comments(
     FOREIGN KEY (post_no) REFERENCES Posts (post_no) ON DELETE CASCADE,
     FOREIGN KEY (student_email) REFERENCES User (email)
 );
+
+CREATE TABLE IF NOT EXISTS Metadata(
+    name TEXT,
+    value TEXT,
+
+    PRIMARY KEY (name)
+);
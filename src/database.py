@@ -0,0 +1,117 @@
+import os
+import sqlite3 as sql
+
+from contextlib import contextmanager
+from flask import g
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import QueuePool
+from threading import Lock
+
+from migrations import migrate
+
+# database.py owns every connection to the sqlite database.
+# Connections are pooled by the SQLAlchemy engine so that the User model used by flask_login and the raw sqlite
+# helpers in app.py share the same set of connections. Each request borrows one connection the first time it needs
+# one and gives it back to the pool when the app context is torn down. Users are read on that connection too, rather
+# than through the ORM session, so a request never holds two.
+# Nothing here touches the database until then: the schema is brought up to date on the first connection handed out.
+
+DATABASE_PATH = os.environ.get('NITTANYPATH_DB', 'database.db')
+
+# How long a connection waits on a locked database before giving up.
+BUSY_TIMEOUT_MS = 5000
+
+# Page cache per connection, in KiB.
+CACHE_SIZE_KB = 16000
+
+# Connections kept open in the pool, and how many more may be opened under load.
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+
+db = SQLAlchemy()
+
+# Functions each request's connection is passed through before it is handed out, such as metrics.instrument.
+connection_wrappers = []
+
+# Whether this process has brought the schema up to date yet.
+schema_ready = False
+schema_lock = Lock()
+
+
+# Opens a new sqlite connection with the settings every connection in the pool should have.
+# WAL lets readers keep going while a writer commits, and NORMAL sync is safe under WAL.
+def open_connection(path=None):
+    connection = sql.connect(path or DATABASE_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.execute('PRAGMA busy_timeout = %d' % BUSY_TIMEOUT_MS)
+    connection.execute('PRAGMA cache_size = -%d' % CACHE_SIZE_KB)
+    return connection
+
+
+# Wires the shared pool into a Flask app.
+def init_app(app):
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///' + DATABASE_PATH)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        'creator': open_connection,
+        'poolclass': QueuePool,
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+    })
+    db.init_app(app)
+    app.before_request(prepare_schema)
+    app.teardown_appcontext(close_connection)
+
+
+# Runs in each worker process a pre-fork server starts, see gunicorn.conf.py. Connections must not be shared across a
+# fork, so any the parent opened are dropped without being closed, and the worker opens its first one of its own.
+def init_worker(app):
+    with app.app_context():
+        db.engine.dispose(close=False)
+        db.engine.raw_connection().close()
+
+
+# Returns the connection for the current request, checking one out of the pool if needed.
+def get_connection():
+    if 'connection' not in g:
+        g.connection = db.engine.raw_connection()
+        if not schema_ready:
+            migrate_once(g.connection)
+        for wrap in connection_wrappers:
+            g.connection = wrap(g.connection)
+    return g.connection
+
+
+# Migrates the database the first time this process hands out a connection. See migrations.py.
+def migrate_once(connection):
+    global schema_ready
+    with schema_lock:
+        if not schema_ready:
+            migrate(connection)
+            schema_ready = True
+
+
+# Runs before each request, so that requests which only go through SQLAlchemy still find the schema up to date.
+def prepare_schema():
+    if not schema_ready:
+        get_connection()
+
+
+# Returns the request's connection to the pool. Anything left uncommitted is rolled back by the pool.
+def close_connection(exception=None):
+    connection = g.pop('connection', None)
+    if connection is not None:
+        connection.close()
+
+
+# Runs the body of a with block as one transaction that holds the database's write lock from the start, so nothing
+# it reads can change before it writes. Commits at the end of the block, or rolls back if it raises.
+@contextmanager
+def immediate_transaction(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
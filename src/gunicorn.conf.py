@@ -0,0 +1,70 @@
+import os
+
+# gunicorn.conf.py configures the production server. Run it from the src directory with:
+#
+#   gunicorn --config gunicorn.conf.py app:app
+#
+# The master process imports the app and brings database.db up to date once, then forks the workers, so workers
+# start quickly and never race each other to migrate. Each worker then opens connections of its own.
+#
+# kill -HUP the master to replace the workers gracefully with the current settings: old workers finish the requests
+# they hold before they exit. The app is imported only once, in the master, so shipping new code takes a new master
+# (kill -USR2, then -QUIT the old one). Workers are also replaced after NITTANYPATH_MAX_REQUESTS requests each.
+
+
+# The cores this process may run on, which may be fewer than the machine has.
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = os.environ.get('NITTANYPATH_BIND', '0.0.0.0:5000')
+
+workers = int(os.environ.get('NITTANYPATH_WORKERS', 2 * available_cores() + 1))
+
+# Threads per worker. With 1, each worker serves one request at a time and the timeout below applies to each
+# request; with more, it only catches workers that stop responding altogether.
+threads = int(os.environ.get('NITTANYPATH_THREADS', 1))
+
+# Seconds a request may take before its worker is killed and replaced.
+timeout = int(os.environ.get('NITTANYPATH_REQUEST_TIMEOUT', 30))
+
+# Seconds workers get to finish their requests when restarting or shutting down.
+graceful_timeout = int(os.environ.get('NITTANYPATH_GRACEFUL_TIMEOUT', 30))
+
+max_requests = int(os.environ.get('NITTANYPATH_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+
+# Set NITTANYPATH_POPULATE=0 when database.db is built elsewhere, such as by benchmarks.py scale-data, so it is only
+# migrated and never rebuilt from the CSVs.
+POPULATE = os.environ.get('NITTANYPATH_POPULATE', '1') != '0'
+
+
+# Runs in the master before any worker is forked.
+def on_starting(server):
+    import database
+    from catalog import get_catalog
+    from migrations import migrate
+    from PopulateScript import ensure_populated
+
+    if POPULATE:
+        # Only rebuilds the database when the CSVs or schema changed since it was last built.
+        ensure_populated(snapshot=os.environ.get('NITTANYPATH_SNAPSHOT'))
+    else:
+        connection = database.open_connection()
+        migrate(connection)
+        connection.close()
+
+    # Workers inherit these, so none of them checks the schema again or loads the catalog itself.
+    database.schema_ready = True
+    get_catalog()
+
+
+def post_fork(server, worker):
+    from app import app
+    from database import init_worker
+
+    init_worker(app)
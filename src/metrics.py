@@ -0,0 +1,267 @@
+import logging
+import os
+
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from threading import Lock
+from time import perf_counter
+
+import database
+
+# metrics.py measures what each route costs: how long its requests take, and how many SQL statements they run, how
+# long those spend in sqlite and how many rows they return. The totals are served at /metrics in the Prometheus text
+# format, and any statement slower than NITTANYPATH_SLOW_QUERY_MS is logged with its parameters redacted.
+#
+# Statements are measured by wrapping the connection database.get_connection() hands each request, so every helper
+# in app.py is covered without changing it. Statements run through the SQLAlchemy session are not counted; the app
+# reads users on the request's connection instead, so none run during requests today.
+# Setting NITTANYPATH_METRICS=0 installs nothing at all: connections are not wrapped, no request hooks run and
+# /metrics does not exist.
+
+ENABLED = os.environ.get('NITTANYPATH_METRICS', '1') != '0'
+
+# Statements that take longer than this, in seconds, are logged.
+SLOW_QUERY_SECONDS = float(os.environ.get('NITTANYPATH_SLOW_QUERY_MS', 100)) / 1000
+
+# Upper bounds of the request latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('nittanypath.slow_queries')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(pairs)
+
+
+# A value per set of labels that only goes up. Labels are a tuple of (name, value) pairs.
+class Counter:
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name, format_labels(labels), value))
+        return lines
+
+
+# Counts observations per set of labels into buckets by upper bound, with their sum.
+class Histogram:
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self.lock:
+            for labels, counts in sorted(self.values.items()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    total += count
+                    lines.append('%s_bucket%s %d' % (self.name, format_labels(labels + (('le', bound),)), total))
+                lines.append('%s_sum%s %s' % (self.name, format_labels(labels), counts[-1]))
+                lines.append('%s_count%s %d' % (self.name, format_labels(labels), total))
+        return lines
+
+
+requests_total = Counter('nittanypath_requests_total', 'Requests served, by route, method and status.')
+request_seconds = Histogram('nittanypath_request_duration_seconds', 'Time to serve a request, by route.',
+                            LATENCY_BUCKETS)
+sql_queries = Counter('nittanypath_sql_queries_total',
+                      'SQL statements run on the request connection, by route. ORM session queries are excluded.')
+sql_seconds = Counter('nittanypath_sql_duration_seconds_total',
+                      'Time spent running SQL statements on the request connection, by route. '
+                      'ORM session queries are excluded.')
+sql_rows = Counter('nittanypath_sql_rows_total',
+                   'Rows SQL statements on the request connection returned, by route. '
+                   'ORM session queries are excluded.')
+slow_queries = Counter('nittanypath_sql_slow_queries_total', 'SQL statements slower than the slow query threshold.')
+
+METRICS = [requests_total, request_seconds, sql_queries, sql_seconds, sql_rows, slow_queries]
+
+# Caches whose stats are reported, by name. See init_app.
+caches = {}
+
+
+# What one request's SQL statements have cost so far.
+class QueryStats:
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+# Shows a statement's parameters by type only, so logs never hold the values users typed.
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+# A cursor that adds the time spent stepping it and the rows it returns to its request's QueryStats.
+class InstrumentedCursor:
+
+    def __init__(self, cursor, stats, statement, parameters, elapsed):
+        self.cursor = cursor
+        self.stats = stats
+        self.statement = statement
+        self.parameters = parameters
+        self.elapsed = 0.0
+        self.timed(elapsed, 0)
+
+    def timed(self, elapsed, rows):
+        self.stats.seconds += elapsed
+        self.stats.rows += rows
+        crossed = self.elapsed < SLOW_QUERY_SECONDS <= self.elapsed + elapsed
+        self.elapsed += elapsed
+        if crossed:
+            slow_queries.inc(())
+            slow_query_log.warning("slow query (%.0f ms so far): %s parameters=%s", self.elapsed * 1000,
+                                   ' '.join(self.statement.split()), redact(self.parameters))
+
+    def fetchone(self):
+        start = perf_counter()
+        row = self.cursor.fetchone()
+        self.timed(perf_counter() - start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = self.cursor.fetchmany() if size is None else self.cursor.fetchmany(size)
+        self.timed(perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = self.cursor.fetchall()
+        self.timed(perf_counter() - start, len(rows))
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+# Wraps a request's pooled connection so every statement run on it is counted and timed.
+class InstrumentedConnection:
+
+    def __init__(self, connection, stats):
+        self.connection = connection
+        self.stats = stats
+
+    def execute(self, statement, parameters=()):
+        self.stats.queries += 1
+        start = perf_counter()
+        cursor = self.connection.execute(statement, parameters)
+        return InstrumentedCursor(cursor, self.stats, statement, parameters, perf_counter() - start)
+
+    def executemany(self, statement, rows):
+        rows = list(rows)
+        self.stats.queries += 1
+        start = perf_counter()
+        cursor = self.connection.executemany(statement, rows)
+        return InstrumentedCursor(cursor, self.stats, statement, rows[0] if rows else (), perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+# Outside of a request, such as in scripts, statements are still timed for the slow query log but not recorded.
+# A request's stats are made by whichever comes first, this or start_request, since a before_request hook registered
+# ahead of start_request may already have opened the request's connection.
+def instrument(connection):
+    if not has_request_context():
+        return InstrumentedConnection(connection, QueryStats())
+    return InstrumentedConnection(connection, g.setdefault('query_stats', QueryStats()))
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def start_request():
+    g.setdefault('query_stats', QueryStats())
+
+
+def note_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+def finish_request(exception=None):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return
+
+    route = (('route', route_label()),)
+    status = g.pop('response_status', 500 if exception is not None else 200)
+    requests_total.inc(route + (('method', request.method), ('status', status)))
+    request_seconds.observe(route, perf_counter() - stats.started)
+    sql_queries.inc(route, stats.queries)
+    sql_seconds.inc(route, stats.seconds)
+    sql_rows.inc(route, stats.rows)
+
+
+# Serves every metric in the Prometheus text format.
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+
+    for stat, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+        name = 'nittanypath_cache_%s%s' % (stat, '_total' if kind == 'counter' else '')
+        lines += ['# HELP %s Cache %s, by cache.' % (name, stat), '# TYPE %s %s' % (name, kind)]
+        for cache_name, cache in sorted(caches.items()):
+            lines.append('%s%s %s' % (name, format_labels((('cache', cache_name),)), cache.stats()[stat]))
+
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+# Turns metrics on for an app, unless NITTANYPATH_METRICS=0. named_caches are LRUCaches to report the stats of.
+def init_app(app, named_caches=None):
+    if not ENABLED:
+        return
+
+    caches.update(named_caches or {})
+    if instrument not in database.connection_wrappers:
+        database.connection_wrappers.append(instrument)
+
+    app.before_request(start_request)
+    app.after_request(note_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', render_metrics)
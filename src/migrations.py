@@ -0,0 +1,438 @@
+import ast
+import logging
+import re
+import sqlite3 as sql
+import sys
+
+# migrations.py keeps the schema of an existing database.db up to date.
+# Each migration has a version number and the SQL that takes the database from the previous version to that one.
+# The version a database is at is stored in its PRAGMA user_version, so a migration only ever runs once.
+#
+# Running this file migrates database.db, and "python migrations.py --check" checks that every query in the app is
+# answered from an index instead of a full table scan, exiting non-zero if one is not.
+# "python migrations.py --rebuild-grade-summary" recomputes the Grade_Summary table from the grade tables.
+# Each migration applied is logged, which the app usually does inside the first request of a process.
+
+log = logging.getLogger(__name__)
+
+
+def read_file(name):
+    with open(name) as file:
+        return file.read()
+
+
+MIGRATIONS = [
+    # Version 1 is the original schema.
+    (1, 'create tables', lambda: read_file('createTables.sql')),
+
+    # Version 2 indexes the columns the app filters on that are not a prefix of a primary key.
+    (2, 'index hot predicates', lambda: '''
+        CREATE INDEX IF NOT EXISTS Enrolls_section ON Enrolls (course_id, section_no);
+        CREATE INDEX IF NOT EXISTS Courses_teaching_team ON Courses (teaching_team_id);
+        CREATE INDEX IF NOT EXISTS TA_Teaching_Teams_team ON TA_Teaching_Teams (teaching_team_id);
+        CREATE INDEX IF NOT EXISTS Prof_Teaching_Teams_team ON Prof_Teaching_Teams (teaching_team_id);
+        CREATE INDEX IF NOT EXISTS Posts_author ON Posts (student_email, course_id);
+        CREATE INDEX IF NOT EXISTS Comments_author ON Comments (student_email, course_id);
+        CREATE INDEX IF NOT EXISTS Homework_Grades_assignment ON Homework_Grades (course_id, sec_no, hw_no);
+        CREATE INDEX IF NOT EXISTS Exam_Grades_exam ON Exam_Grades (course_id, sec_no, exam_no);
+    '''),
+
+    # Version 3 adds Grade_Summary, each student's grade totals per course section, kept current by triggers.
+    (3, 'materialize grade summaries', lambda: grade_summary_schema() + REBUILD_GRADE_SUMMARY),
+
+    # Version 4 adds Courses_Search, a full text index over Courses kept in sync by triggers.
+    (4, 'full text course search', lambda: '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS Courses_Search USING fts5(
+            course_id, course_name, course_desc, content='Courses', content_rowid='rowid'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS Courses_search_insert AFTER INSERT ON Courses
+        BEGIN
+            INSERT INTO Courses_Search (rowid, course_id, course_name, course_desc)
+            VALUES (NEW.rowid, NEW.course_id, NEW.course_name, NEW.course_desc);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Courses_search_update AFTER UPDATE OF course_id, course_name, course_desc ON Courses
+        BEGIN
+            INSERT INTO Courses_Search (Courses_Search, rowid, course_id, course_name, course_desc)
+            VALUES ('delete', OLD.rowid, OLD.course_id, OLD.course_name, OLD.course_desc);
+            INSERT INTO Courses_Search (rowid, course_id, course_name, course_desc)
+            VALUES (NEW.rowid, NEW.course_id, NEW.course_name, NEW.course_desc);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Courses_search_delete AFTER DELETE ON Courses
+        BEGIN
+            INSERT INTO Courses_Search (Courses_Search, rowid, course_id, course_name, course_desc)
+            VALUES ('delete', OLD.rowid, OLD.course_id, OLD.course_name, OLD.course_desc);
+        END;
+
+        INSERT INTO Courses_Search (Courses_Search) VALUES ('rebuild');
+    '''),
+
+    # Version 5 keeps a count of each section's enrolled students on Sections, maintained by triggers on Enrolls,
+    # so enrolling can check and take a seat in one statement.
+    (5, 'section seat counters', lambda: '''
+        ALTER TABLE Sections ADD COLUMN enrolled_count INT NOT NULL DEFAULT 0;
+
+        UPDATE Sections SET enrolled_count = (
+            SELECT COUNT(*) FROM Enrolls WHERE course_id = Sections.course_id AND section_no = Sections.sec_no
+        );
+
+        CREATE TRIGGER IF NOT EXISTS Enrolls_count_insert AFTER INSERT ON Enrolls
+        BEGIN
+            UPDATE Sections SET enrolled_count = enrolled_count + 1
+            WHERE course_id = NEW.course_id AND sec_no = NEW.section_no;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Enrolls_count_update AFTER UPDATE OF course_id, section_no ON Enrolls
+        BEGIN
+            UPDATE Sections SET enrolled_count = enrolled_count - 1
+            WHERE course_id = OLD.course_id AND sec_no = OLD.section_no;
+            UPDATE Sections SET enrolled_count = enrolled_count + 1
+            WHERE course_id = NEW.course_id AND sec_no = NEW.section_no;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Enrolls_count_delete AFTER DELETE ON Enrolls
+        BEGIN
+            UPDATE Sections SET enrolled_count = enrolled_count - 1
+            WHERE course_id = OLD.course_id AND sec_no = OLD.section_no;
+        END;
+    '''),
+
+    # Version 6 adds Page_Versions, a version number and last change time for each set of data cached pages are built
+    # from: the course catalog, and each course's posts and comments. Triggers bump them on every write, so cached
+    # pages are invalidated whichever path, or worker process, made the change. See pagecache.py.
+    (6, 'page versions', lambda: '''
+        CREATE TABLE IF NOT EXISTS Page_Versions (
+            scope TEXT,
+            course_id TEXT,
+            version INT NOT NULL,
+            changed_at INT NOT NULL,
+
+            PRIMARY KEY (scope, course_id)
+        );
+
+        INSERT OR IGNORE INTO Page_Versions (scope, course_id, version, changed_at)
+        SELECT 'catalog', '', 1, CAST(strftime('%s', 'now') AS INT);
+        INSERT OR IGNORE INTO Page_Versions (scope, course_id, version, changed_at)
+        SELECT 'posts', course_id, 1, CAST(strftime('%s', 'now') AS INT) FROM Courses;
+
+        CREATE TRIGGER IF NOT EXISTS User_page_rename AFTER UPDATE OF name ON User
+        BEGIN
+            UPDATE Page_Versions SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INT)
+            WHERE scope = 'posts';
+        END;
+    ''' + ''.join(bump_page_version_trigger(*trigger) for trigger in PAGE_VERSION_TRIGGERS)),
+
+    # Version 7 also bumps the catalog version on writes to the rest of the reference data kept in memory by
+    # catalog.py. Section seat counts are left out, since they change with every enrollment.
+    (7, 'catalog versions', lambda: ''.join(bump_page_version_trigger(*trigger)
+                                            for trigger in CATALOG_VERSION_TRIGGERS)),
+
+    # Version 8 adds User_Versions, a version number for everything each worker process caches about a user: their
+    # User row, whether they are a student or professor, their enrollments and their teaching teams. Triggers bump it
+    # on every write, so a cached copy is dropped by every worker, not only the one that made the change. See
+    # viewer.py. Users never written since have version 0.
+    (8, 'user versions', lambda: '''
+        CREATE TABLE IF NOT EXISTS User_Versions (
+            email TEXT,
+            version INT NOT NULL,
+
+            PRIMARY KEY (email)
+        );
+    ''' + ''.join(bump_user_version_trigger(*trigger) for trigger in USER_VERSION_TRIGGERS)),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Recomputes one student's Grade_Summary row for a course section from both grade tables.
+# {student}, {course} and {sec} are filled in with the trigger's NEW or OLD row.
+REFRESH_GRADE_SUMMARY = '''
+    INSERT OR REPLACE INTO Grade_Summary
+        (student_email, course_id, sec_no, hw_sum, hw_count, hw_avg, exam_sum, exam_count, exam_avg)
+    SELECT {student}, {course}, {sec}, hw.total, hw.counted, hw.average, exam.total, exam.counted, exam.average
+    FROM (SELECT SUM(grade) AS total, COUNT(grade) AS counted, AVG(grade) AS average FROM Homework_Grades
+          WHERE student_email = {student} AND course_id = {course} AND sec_no = {sec}) AS hw,
+         (SELECT SUM(grade) AS total, COUNT(grade) AS counted, AVG(grade) AS average FROM Exam_Grades
+          WHERE student_email = {student} AND course_id = {course} AND sec_no = {sec}) AS exam;
+'''
+
+# Throws away every Grade_Summary row and recomputes them all from the grade tables.
+REBUILD_GRADE_SUMMARY = '''
+    DELETE FROM Grade_Summary;
+    INSERT INTO Grade_Summary
+        (student_email, course_id, sec_no, hw_sum, hw_count, hw_avg, exam_sum, exam_count, exam_avg)
+    SELECT student_email, course_id, sec_no,
+           SUM(hw_grade), COUNT(hw_grade), AVG(hw_grade), SUM(exam_grade), COUNT(exam_grade), AVG(exam_grade)
+    FROM (SELECT student_email, course_id, sec_no, grade AS hw_grade, NULL AS exam_grade FROM Homework_Grades
+          UNION ALL
+          SELECT student_email, course_id, sec_no, NULL, grade FROM Exam_Grades)
+    GROUP BY student_email, course_id, sec_no;
+'''
+
+
+# The writes that change what cached pages show: (trigger name, event, scope, course_id expression).
+PAGE_VERSION_TRIGGERS = [
+    ('Courses_page_insert', 'INSERT ON Courses', 'catalog', "''"),
+    ('Courses_page_update', 'UPDATE ON Courses', 'catalog', "''"),
+    ('Courses_page_delete', 'DELETE ON Courses', 'catalog', "''"),
+    ('Posts_page_insert', 'INSERT ON Posts', 'posts', 'NEW.course_id'),
+    ('Posts_page_update', 'UPDATE ON Posts', 'posts', 'NEW.course_id'),
+    ('Posts_page_delete', 'DELETE ON Posts', 'posts', 'OLD.course_id'),
+    ('Comments_page_insert', 'INSERT ON Comments', 'posts', 'NEW.course_id'),
+    ('Comments_page_update', 'UPDATE ON Comments', 'posts', 'NEW.course_id'),
+    ('Comments_page_delete', 'DELETE ON Comments', 'posts', 'OLD.course_id'),
+]
+
+# The writes to the rest of the reference data catalog.py keeps, in the same form.
+CATALOG_VERSION_TRIGGERS = [
+    ('Sections_catalog_insert', 'INSERT ON Sections', 'catalog', "''"),
+    ('Sections_catalog_update', 'UPDATE OF course_id, sec_no, max_limit ON Sections', 'catalog', "''"),
+    ('Sections_catalog_delete', 'DELETE ON Sections', 'catalog', "''"),
+    ('Professors_catalog_insert', 'INSERT ON Professors', 'catalog', "''"),
+    ('Professors_catalog_update', 'UPDATE ON Professors', 'catalog', "''"),
+    ('Professors_catalog_delete', 'DELETE ON Professors', 'catalog', "''"),
+    ('Prof_Teaching_Teams_catalog_insert', 'INSERT ON Prof_Teaching_Teams', 'catalog', "''"),
+    ('Prof_Teaching_Teams_catalog_update', 'UPDATE ON Prof_Teaching_Teams', 'catalog', "''"),
+    ('Prof_Teaching_Teams_catalog_delete', 'DELETE ON Prof_Teaching_Teams', 'catalog', "''"),
+    ('Zipcodes_catalog_insert', 'INSERT ON Zipcodes', 'catalog', "''"),
+    ('Zipcodes_catalog_update', 'UPDATE ON Zipcodes', 'catalog', "''"),
+    ('Zipcodes_catalog_delete', 'DELETE ON Zipcodes', 'catalog', "''"),
+]
+
+
+# The writes that change what is cached about a user, as (trigger name, event, the user's email in each row it
+# touches). An update may move a row from one user to another, so it bumps both.
+USER_VERSION_TRIGGERS = [
+    ('User_version_update', 'UPDATE ON User', ('OLD.email', 'NEW.email')),
+    ('User_version_delete', 'DELETE ON User', ('OLD.email',)),
+    ('Students_version_insert', 'INSERT ON Students', ('NEW.email',)),
+    ('Students_version_update', 'UPDATE OF email ON Students', ('OLD.email', 'NEW.email')),
+    ('Students_version_delete', 'DELETE ON Students', ('OLD.email',)),
+    ('Professors_version_insert', 'INSERT ON Professors', ('NEW.email',)),
+    ('Professors_version_update', 'UPDATE OF email ON Professors', ('OLD.email', 'NEW.email')),
+    ('Professors_version_delete', 'DELETE ON Professors', ('OLD.email',)),
+    ('Enrolls_version_insert', 'INSERT ON Enrolls', ('NEW.student_email',)),
+    ('Enrolls_version_update', 'UPDATE ON Enrolls', ('OLD.student_email', 'NEW.student_email')),
+    ('Enrolls_version_delete', 'DELETE ON Enrolls', ('OLD.student_email',)),
+    ('TA_Teaching_Teams_version_insert', 'INSERT ON TA_Teaching_Teams', ('NEW.student_email',)),
+    ('TA_Teaching_Teams_version_update', 'UPDATE ON TA_Teaching_Teams', ('OLD.student_email', 'NEW.student_email')),
+    ('TA_Teaching_Teams_version_delete', 'DELETE ON TA_Teaching_Teams', ('OLD.student_email',)),
+    ('Prof_Teaching_Teams_version_insert', 'INSERT ON Prof_Teaching_Teams', ('NEW.prof_email',)),
+    ('Prof_Teaching_Teams_version_update', 'UPDATE ON Prof_Teaching_Teams', ('OLD.prof_email', 'NEW.prof_email')),
+    ('Prof_Teaching_Teams_version_delete', 'DELETE ON Prof_Teaching_Teams', ('OLD.prof_email',)),
+]
+
+
+def bump_page_version_trigger(name, event, scope, course_id):
+    return '''
+        CREATE TRIGGER IF NOT EXISTS %s AFTER %s
+        BEGIN
+            INSERT INTO Page_Versions (scope, course_id, version, changed_at)
+            VALUES ('%s', %s, 1, CAST(strftime('%%s', 'now') AS INT))
+            ON CONFLICT (scope, course_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+        END;
+    ''' % (name, event, scope, course_id)
+
+
+def bump_user_version_trigger(name, event, emails):
+    bumps = ''.join('''
+            INSERT INTO User_Versions (email, version) VALUES (%s, 1)
+            ON CONFLICT (email) DO UPDATE SET version = version + 1;''' % email for email in emails)
+    return '''
+        CREATE TRIGGER IF NOT EXISTS %s AFTER %s
+        BEGIN%s
+        END;
+    ''' % (name, event, bumps)
+
+
+def refresh_grade_summary(row):
+    return REFRESH_GRADE_SUMMARY.format(student=row + '.student_email', course=row + '.course_id', sec=row + '.sec_no')
+
+
+def grade_summary_schema():
+    script = '''
+        CREATE TABLE IF NOT EXISTS Grade_Summary(
+            student_email TEXT,
+            course_id TEXT,
+            sec_no INT,
+            hw_sum INT,
+            hw_count INT,
+            hw_avg REAL,
+            exam_sum INT,
+            exam_count INT,
+            exam_avg REAL,
+
+            PRIMARY KEY (student_email, course_id, sec_no)
+        );
+    '''
+
+    for table in ('Homework_Grades', 'Exam_Grades'):
+        script += '''
+            CREATE TRIGGER IF NOT EXISTS {table}_summary_insert AFTER INSERT ON {table}
+            BEGIN {new} END;
+
+            CREATE TRIGGER IF NOT EXISTS {table}_summary_update AFTER UPDATE ON {table}
+            BEGIN {new} END;
+
+            CREATE TRIGGER IF NOT EXISTS {table}_summary_move AFTER UPDATE ON {table}
+            WHEN OLD.student_email IS NOT NEW.student_email OR OLD.course_id IS NOT NEW.course_id
+                OR OLD.sec_no IS NOT NEW.sec_no
+            BEGIN {old} END;
+
+            CREATE TRIGGER IF NOT EXISTS {table}_summary_delete AFTER DELETE ON {table}
+            BEGIN {old} END;
+        '''.format(table=table, new=refresh_grade_summary('NEW'), old=refresh_grade_summary('OLD'))
+
+    return script
+
+
+# Recomputes Grade_Summary from scratch, for repairing it if it ever drifts from the grade tables.
+def rebuild_grade_summary(connection):
+    connection.executescript('BEGIN;\n%s\nCOMMIT;' % REBUILD_GRADE_SUMMARY)
+
+
+# Files whose queries --check looks at.
+QUERY_SOURCES = ('app.py', 'viewer.py', 'pagecache.py', 'catalog.py')
+
+# Queries that are meant to read a whole table: the catalog loading all of the reference data (see catalog.py).
+FULL_SCANS_ALLOWED = {
+    'SELECT * FROM Courses ORDER BY course_id',
+    'SELECT course_id, sec_no, max_limit FROM Sections ORDER BY course_id, sec_no',
+    'SELECT t.teaching_team_id, p.* FROM Prof_Teaching_Teams t JOIN Professors p ON p.email = t.prof_email '
+    'ORDER BY t.teaching_team_id, p.email',
+    'SELECT * FROM Zipcodes',
+}
+
+
+PLAN_SCAN = re.compile(r'SCAN (?:TABLE )?(\S+)')
+
+SQL_STATEMENT = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s', re.IGNORECASE)
+
+
+def get_version(connection):
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Splits a script into its statements, keeping trigger bodies whole.
+def split_statements(script):
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sql.complete_statement(statement):
+            if statement.strip(' \t\r\n;'):
+                yield statement.strip()
+            statement = ''
+
+
+# Applies every migration newer than the database's version, each in its own transaction.
+# The transaction takes the write lock up front and checks the version again, so when several workers start at once
+# only the first applies a migration and the rest see it already done.
+# Returns the versions that were applied.
+def migrate(connection):
+    applied = []
+
+    for version, description, script in MIGRATIONS:
+        if version <= get_version(connection):
+            continue
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= get_version(connection):
+                connection.rollback()
+                continue
+
+            log.info("Migrating database to version %d: %s", version, description)
+            for statement in split_statements(script()):
+                connection.execute(statement)
+            connection.execute('PRAGMA user_version = %d' % version)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+        applied.append(version)
+
+    return applied
+
+
+# Pulls every SQL statement written as a string literal out of a source file, whether it is passed straight to
+# connection.execute() or kept in a constant.
+def find_queries(source):
+    queries = []
+
+    for node in ast.walk(ast.parse(read_file(source))):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL_STATEMENT.match(node.value):
+            queries.append((node.lineno, node.value))
+
+    return sorted(queries)
+
+
+# Returns the full table scans in a query's plan, ignoring scans of CTEs, subqueries, temp b-trees and virtual
+# tables such as the full text index, which do their own lookups. Only a SEARCH counts as using an index: a SCAN
+# walks every row even when it walks them through an index.
+def full_scans(connection, query):
+    tables = {name.lower() for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if '?' in query:
+        params = (None,) * query.count('?')
+    else:
+        params = {name: None for name in re.findall(r':(\w+)', query)}
+
+    return [detail for *ids, detail in connection.execute('EXPLAIN QUERY PLAN ' + query, params)
+            if is_full_scan(detail, query, tables)]
+
+
+# Whether a line of a query plan is a full scan of one of tables. SQLite before 3.36 writes "SCAN TABLE Posts AS p"
+# where later versions write "SCAN p".
+def is_full_scan(detail, query, tables):
+    match = PLAN_SCAN.match(detail)
+    return bool(match) and 'VIRTUAL' not in detail.split() and resolve_table(query, match.group(1)) in tables
+
+
+# Maps a name from a query plan back to its table, so "SCAN p" in "FROM Posts p" is reported against Posts.
+def resolve_table(query, name):
+    words = query.replace(',', ' ').replace('(', ' ').replace(')', ' ').split()
+    for i, word in enumerate(words[:-1]):
+        if words[i + 1] == name and words[i - 1].upper() in ('FROM', 'JOIN'):
+            return word.lower()
+        if words[i + 1].upper() == 'AS' and i + 2 < len(words) and words[i + 2] == name:
+            return word.lower()
+    return name.lower()
+
+
+# Migrates an empty in-memory database to the latest version and checks the plan of every query in sources.
+# Returns (source, line, query, scans) for each query that would scan a whole table.
+def check_query_plans(sources=QUERY_SOURCES):
+    connection = sql.connect(':memory:')
+    migrate(connection)
+
+    failures = []
+    for source in sources:
+        for line, query in find_queries(source):
+            if ' '.join(query.split()) in FULL_SCANS_ALLOWED or query.lstrip().upper().startswith('PRAGMA'):
+                continue
+            scans = full_scans(connection, query)
+            if scans:
+                failures.append((source, line, query, scans))
+
+    connection.close()
+    return failures
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if '--check' in sys.argv:
+        failures = check_query_plans()
+        for source, line, query, scans in failures:
+            print("%s:%d %s\n    %s" % (source, line, ' '.join(query.split()), '\n    '.join(scans)))
+        print("%d queries scan a whole table" % len(failures))
+        sys.exit(1 if failures else 0)
+
+    from database import DATABASE_PATH
+
+    connection = sql.connect(DATABASE_PATH)
+    migrate(connection)
+
+    if '--rebuild-grade-summary' in sys.argv:
+        rebuild_grade_summary(connection)
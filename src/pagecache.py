@@ -0,0 +1,70 @@
+import hashlib
+import os
+
+from flask import make_response, request
+from time import time
+
+from cache import LRUCache, MISSING
+from catalog import get_catalog
+from database import get_connection
+
+# Rendered pages that look the same to everyone with the same role are kept across requests, keyed by the page, its
+# arguments, the viewer's variant of it and the versions of the data it is built from. Those versions live in
+# Page_Versions and are bumped by triggers on every write (see migrations.py), so a write by any path or worker
+# process moves later requests on to a new key, and the stale page is left to age out.
+# Every cached page is served with an ETag and Last-Modified, so browsers revalidating it get a 304 instead.
+
+page_cache = LRUCache(int(os.environ.get('NITTANYPATH_PAGE_CACHE_SIZE', 1000)),
+                      int(os.environ.get('NITTANYPATH_PAGE_CACHE_TTL', 300)))
+
+# The course catalog, shown by class search and every course's info page.
+CATALOG = ('catalog', '')
+
+# Pages built from no data, such as the home page, last changed when this process started.
+STARTED = int(time())
+
+
+# The scope of a course's posts and comments, shown by its board.
+def course_posts(course_id):
+    return 'posts', course_id
+
+
+# Returns (version, changed_at) for each (scope, course_id). Data never written since Page_Versions was added has
+# version 0. The catalog's version is the one of the in-memory catalog pages are built from, which may briefly lag
+# the database, so that a page is never kept under a newer version than the data it shows.
+def data_versions(scopes):
+    connection = get_connection()
+    versions = []
+    for scope, course_id in scopes:
+        if (scope, course_id) == CATALOG:
+            catalog = get_catalog()
+            versions.append((catalog.version, catalog.changed_at))
+            continue
+        cursor = connection.execute('SELECT version, changed_at FROM Page_Versions WHERE scope = ? AND course_id = ?',
+                                    (scope, course_id,))
+        versions.append(cursor.fetchone() or (0, STARTED))
+    return tuple(versions)
+
+
+# Serves the page render() builds from the data in scopes, rendering it only when there is no copy for the current
+# versions of that data. variant tells apart the versions of the page different viewers get.
+# render() may return a response, such as a redirect, instead of a page; that is served as it is and not kept.
+def cached_page(scopes, variant, render):
+    versions = data_versions(scopes)
+    key = (request.endpoint, tuple(sorted(request.view_args.items())), tuple(sorted(request.args.items(multi=True))),
+           variant, versions)
+
+    entry = page_cache.get(key)
+    if entry is MISSING:
+        page = render()
+        if not isinstance(page, str):
+            return page
+        entry = (page, hashlib.blake2b(page.encode(), digest_size=16).hexdigest())
+        page_cache.set(key, entry)
+
+    response = make_response(entry[0])
+    response.set_etag(entry[1])
+    response.last_modified = max((changed_at for version, changed_at in versions), default=STARTED)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
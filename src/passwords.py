@@ -0,0 +1,191 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+
+from concurrent.futures import ThreadPoolExecutor
+
+# passwords.py hashes and checks user passwords.
+# New passwords are stored as "<algorithm>$<cost>$<salt>$<hash>" by the hasher picked with NITTANYPATH_PASSWORD_HASHER,
+# scrypt by default or pbkdf2_sha256, each with a tunable cost. Older databases hold bare MD4 hex digests, which
+# still verify but are reported as needing a rehash, so login can upgrade them.
+# Hashing is slow on purpose, so it runs on a small bounded pool of worker threads. The request thread still waits for
+# its hash; the pool only caps how many hashes run at once, so a burst of logins queues up instead of taking every CPU.
+
+
+# Uses OpenSSL's MD4 where it is still available, since newer OpenSSL builds dropped it.
+def md4_hexdigest(data):
+    try:
+        return hashlib.new('md4', data).hexdigest()
+    except ValueError:
+        return _md4(data).hex()
+
+
+# MD4 as in RFC 1320, only used to check and write legacy hashes.
+def _md4(data):
+    def rotate(x, n):
+        x &= 0xffffffff
+        return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+    message = data + b'\x80' + b'\x00' * ((55 - len(data)) % 64) + struct.pack('<Q', len(data) * 8 % 2 ** 64)
+    state = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+
+    for offset in range(0, len(message), 64):
+        x = struct.unpack('<16I', message[offset:offset + 64])
+        a, b, c, d = state
+
+        for i in range(16):
+            k, s = i, (3, 7, 11, 19)[i % 4]
+            a, b, c, d = d, rotate(a + ((b & c) | (~b & d)) + x[k], s), b, c
+        for i in range(16):
+            k, s = (i % 4) * 4 + i // 4, (3, 5, 9, 13)[i % 4]
+            a, b, c, d = d, rotate(a + ((b & c) | (b & d) | (c & d)) + x[k] + 0x5a827999, s), b, c
+        for i in range(16):
+            k, s = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)[i], (3, 9, 11, 15)[i % 4]
+            a, b, c, d = d, rotate(a + (b ^ c ^ d) + x[k] + 0x6ed9eba1, s), b, c
+
+        state = [(value + new) & 0xffffffff for value, new in zip(state, (a, b, c, d))]
+
+    return struct.pack('<4I', *state)
+
+
+def _encode(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+# Hashes with scrypt. n is the CPU and memory cost, a power of two; r the block size and p the parallelism.
+class ScryptHasher:
+    algorithm = 'scrypt'
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.n = n
+        self.r = r
+        self.p = p
+
+    def derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p,
+                              dklen=32)
+
+    def encode(self, password):
+        salt = os.urandom(16)
+        raw = self.derive(password, salt, self.n, self.r, self.p)
+        return '%s$%d,%d,%d$%s$%s' % (self.algorithm, self.n, self.r, self.p, _encode(salt), _encode(raw))
+
+    def verify(self, password, encoded):
+        algorithm, cost, salt, raw = encoded.split('$')
+        n, r, p = (int(part) for part in cost.split(','))
+        return hmac.compare_digest(self.derive(password, _decode(salt), n, r, p), _decode(raw))
+
+    def must_update(self, encoded):
+        return encoded.split('$')[1] != '%d,%d,%d' % (self.n, self.r, self.p)
+
+
+# Hashes with PBKDF2-HMAC-SHA256 over the given number of iterations.
+class PBKDF2Hasher:
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+
+    def encode(self, password):
+        salt = os.urandom(16)
+        raw = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations)
+        return '%s$%d$%s$%s' % (self.algorithm, self.iterations, _encode(salt), _encode(raw))
+
+    def verify(self, password, encoded):
+        algorithm, iterations, salt, raw = encoded.split('$')
+        given = hashlib.pbkdf2_hmac('sha256', password.encode(), _decode(salt), int(iterations))
+        return hmac.compare_digest(given, _decode(raw))
+
+    def must_update(self, encoded):
+        return int(encoded.split('$')[1]) != self.iterations
+
+
+# The unsalted MD4 hex digests the database was first populated with. Never used for new passwords.
+class MD4Hasher:
+    algorithm = 'md4'
+
+    def encode(self, password):
+        return md4_hexdigest(password.encode())
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.encode(password), encoded.lower())
+
+    def must_update(self, encoded):
+        return True
+
+
+# Builds the hasher new passwords are stored with, from the environment.
+def configured_hasher():
+    algorithm = os.environ.get('NITTANYPATH_PASSWORD_HASHER', 'scrypt')
+    if algorithm == 'scrypt':
+        return ScryptHasher(n=int(os.environ.get('NITTANYPATH_SCRYPT_N', 2 ** 14)),
+                            r=int(os.environ.get('NITTANYPATH_SCRYPT_R', 8)),
+                            p=int(os.environ.get('NITTANYPATH_SCRYPT_P', 1)))
+    if algorithm == 'pbkdf2_sha256':
+        return PBKDF2Hasher(iterations=int(os.environ.get('NITTANYPATH_PBKDF2_ITERATIONS', 600000)))
+    raise ValueError('unknown password hasher %r' % algorithm)
+
+
+hasher = configured_hasher()
+
+# Every hasher a stored password may have been made with, by algorithm.
+HASHERS = {
+    ScryptHasher.algorithm: ScryptHasher(),
+    PBKDF2Hasher.algorithm: PBKDF2Hasher(),
+    MD4Hasher.algorithm: MD4Hasher(),
+}
+HASHERS[hasher.algorithm] = hasher
+
+# Hashing runs here, so no more than this many hashes are ever being computed at once.
+hashing_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('NITTANYPATH_HASH_WORKERS', os.cpu_count() or 1)),
+                                  thread_name_prefix='password-hash')
+
+
+# Finds the hasher an encoded password was made with. Bare hex digests are legacy MD4.
+def hasher_for(encoded):
+    if '$' not in encoded:
+        return HASHERS[MD4Hasher.algorithm]
+    return HASHERS.get(encoded.split('$', 1)[0])
+
+
+# What passwords of unknown users are checked against, made the first time one is needed.
+_throwaway = []
+
+
+def _hash_password(password):
+    return hasher.encode(password)
+
+
+# Checks a password against its stored encoding. Returns (matches, new encoding), where the new encoding is set only
+# when the password matched but was stored with an old algorithm or cost and should be saved again.
+# A missing encoding is checked against a throwaway hash, so unknown emails take as long as wrong passwords.
+def _check_password(password, encoded):
+    if not encoded:
+        if not _throwaway:
+            _throwaway.append(hasher.encode(''))
+        hasher.verify(password, _throwaway[0])
+        return False, None
+
+    stored_with = hasher_for(encoded)
+    if stored_with is None or not stored_with.verify(password, encoded):
+        return False, None
+
+    if stored_with is not hasher or hasher.must_update(encoded):
+        return True, hasher.encode(password)
+    return True, None
+
+
+# Hashes a new password for storage on the hashing pool, waiting for its turn and for the hash.
+def hash_password(password):
+    return hashing_pool.submit(_hash_password, password).result()
+
+
+# Checks a password against its stored encoding on the hashing pool, waiting like hash_password. See _check_password.
+def check_password(password, encoded):
+    return hashing_pool.submit(_check_password, password, encoded).result()
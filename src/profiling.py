@@ -0,0 +1,222 @@
+import cProfile
+import hmac
+import marshal
+import os
+import pstats
+import random
+
+from flask import Response, abort, g, render_template, request, session
+from threading import Lock
+from time import time_ns
+from urllib.parse import quote, unquote
+
+from metrics import route_label
+
+# profiling.py runs cProfile on some live requests, to show where a slow route spends its time.
+# A request is profiled when it is sampled, at the rate NITTANYPATH_PROFILE_SAMPLE (from 0 to 1, 0 by default), or
+# when it carries an X-Profile-Token header matching NITTANYPATH_PROFILE_TOKEN. Each profile is saved to
+# NITTANYPATH_PROFILE_DIR twice, as pstats data and as collapsed stacks for flamegraph tools, and only the newest
+# NITTANYPATH_PROFILE_KEEP profiles are kept. /admin/profiles adds them up per route, for whoever holds the token.
+# The token is only ever read from the header, never the URL, so it stays out of access logs, history and Referer
+# headers. Opening /admin/profiles with it marks the session, so the page's download links work from a browser too.
+#
+# cProfile can only run one profile at a time safely, so one request is profiled at a time: a request sampled while
+# another is being profiled is served unprofiled, and one carrying the token waits its turn. With neither a sample
+# rate nor a token set nothing is installed.
+
+SAMPLE_RATE = float(os.environ.get('NITTANYPATH_PROFILE_SAMPLE', 0))
+TOKEN = os.environ.get('NITTANYPATH_PROFILE_TOKEN', '')
+TOKEN_HEADER = 'X-Profile-Token'
+
+PROFILE_DIR = os.environ.get('NITTANYPATH_PROFILE_DIR', 'profiles')
+KEEP = max(int(os.environ.get('NITTANYPATH_PROFILE_KEEP', 500)), 1)
+
+# How many functions the admin page lists for each route.
+TOP_FUNCTIONS = 25
+
+# Call paths shorter than this, in seconds, are left out of collapsed stacks.
+MIN_STACK_SECONDS = 1e-6
+
+# Held by the request being profiled.
+profiling_lock = Lock()
+
+# Held while a profile is saved and old ones are removed.
+files_lock = Lock()
+
+
+# Whether the request carries the profiling token in its header.
+def has_token():
+    given = request.headers.get(TOKEN_HEADER, '')
+    return bool(TOKEN) and hmac.compare_digest(given.encode(), TOKEN.encode())
+
+
+# Whether the request may see profiles: it carries the token, or its session was marked by one that did.
+def may_view_profiles():
+    if has_token():
+        session['profiles'] = True
+    return bool(TOKEN) and session.get('profiles', False)
+
+
+def start_profile():
+    if has_token():
+        profiling_lock.acquire()
+    elif not (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE and profiling_lock.acquire(blocking=False)):
+        return
+
+    # Profiles are named so they sort oldest first and say which route they are of.
+    g.profile_name = '%d-%d-%s' % (time_ns() // 1000, os.getpid(), quote(route_label(), safe=''))
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+# Tells whoever asked for a profile which one it is.
+def name_profile(response):
+    if 'profile_name' in g:
+        response.headers['X-Profile'] = g.profile_name
+    return response
+
+
+def finish_profile(exception=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+
+    try:
+        profiler.disable()
+    finally:
+        profiling_lock.release()
+    save_profile(pstats.Stats(profiler), g.pop('profile_name'))
+
+
+# Writes a profile to PROFILE_DIR, then removes the oldest profiles past KEEP. Files are written under a temporary
+# name and then renamed, so other workers reading the directory never see half of one.
+def save_profile(stats, name):
+    path = os.path.join(PROFILE_DIR, name)
+    with files_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(path + '.folded.tmp', 'w') as out:
+            out.writelines(collapse(stats))
+        os.replace(path + '.folded.tmp', path + '.folded')
+        stats.dump_stats(path + '.prof.tmp')
+        os.replace(path + '.prof.tmp', path + '.prof')
+
+        for old in saved_profiles()[:-KEEP]:
+            for extension in ('.prof', '.folded'):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, old + extension))
+                except FileNotFoundError:
+                    pass
+
+
+# Names of the saved profiles, oldest first.
+def saved_profiles():
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len('.prof')] for name in names if name.endswith('.prof'))
+
+
+def function_label(function):
+    return pstats.func_std_string(pstats.func_strip_path(function)).replace(';', ',')
+
+
+# Turns a profile into collapsed stacks, one "outer;inner;... microseconds" line per call path, as flamegraph.pl and
+# speedscope read them. cProfile only records which function called which, not whole stacks, so the time spent in a
+# function is shared out between the paths into it in proportion to how long each caller spent in it.
+def collapse(stats):
+    callees = {}
+    for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, (caller_cc, caller_nc, caller_tt, caller_ct) in callers.items():
+            callees.setdefault(caller, []).append((function, caller_ct))
+
+    totals = {}
+
+    def walk(function, stack, seconds):
+        cc, nc, tt, ct, callers = stats.stats[function]
+        if ct <= 0 or seconds < MIN_STACK_SECONDS:
+            return
+        stack = stack + (function,)
+        path = ';'.join(function_label(each) for each in stack)
+        totals[path] = totals.get(path, 0) + seconds * tt / ct
+        for callee, spent in callees.get(function, ()):
+            if callee not in stack:
+                walk(callee, stack, seconds * spent / ct)
+
+    for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            walk(function, (), ct)
+
+    return ['%s %d\n' % (path, round(seconds * 1e6)) for path, seconds in totals.items() if seconds >= 5e-7]
+
+
+# Adds up the saved profiles of each route. Returns {route: (stats, number of profiles)}.
+def route_profiles():
+    names = {}
+    for name in saved_profiles():
+        names.setdefault(unquote(name.split('-', 2)[2]), []).append(name)
+
+    profiles = {}
+    for route, route_names in names.items():
+        stats, count = None, 0
+        for name in route_names:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(os.path.join(PROFILE_DIR, name + '.prof'))
+                else:
+                    stats.add(os.path.join(PROFILE_DIR, name + '.prof'))
+            except (OSError, EOFError, ValueError):
+                # removed, or not fully written, by another worker since the directory was listed
+                continue
+            count += 1
+        if stats is not None:
+            profiles[route] = (stats, count)
+    return profiles
+
+
+# Lists the functions each route spends the most time in, by cumulative time across its saved profiles.
+def show_profiles():
+    if not may_view_profiles():
+        abort(404)
+
+    routes = []
+    for route, (stats, count) in sorted(route_profiles().items()):
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        functions = [(function_label(function), nc, tt, ct, ct / count)
+                     for function, (cc, nc, tt, ct, callers) in top]
+        routes.append((route, count, functions))
+
+    return render_template('profiles.html', routes=routes)
+
+
+# Serves a route's profiles added up, as pstats data (?kind=prof) or collapsed stacks (?kind=folded).
+def download_profile():
+    if not may_view_profiles():
+        abort(404)
+
+    route = request.args.get('route', '')
+    kind = request.args.get('kind', 'folded')
+    profile = route_profiles().get(route)
+    if profile is None or kind not in ('prof', 'folded'):
+        abort(404)
+
+    stats = profile[0]
+    filename = '%s.%s' % (quote(route, safe='').replace('%', '_'), kind)
+    if kind == 'prof':
+        response = Response(marshal.dumps(stats.stats), mimetype='application/octet-stream')
+    else:
+        response = Response(''.join(collapse(stats)), mimetype='text/plain')
+    response.headers['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+# Turns profiling on for an app, unless neither NITTANYPATH_PROFILE_SAMPLE nor NITTANYPATH_PROFILE_TOKEN is set.
+def init_app(app):
+    if SAMPLE_RATE <= 0 and not TOKEN:
+        return
+
+    app.before_request(start_profile)
+    app.after_request(name_profile)
+    app.teardown_request(finish_profile)
+    app.add_url_rule('/admin/profiles', 'profiles', show_profiles)
+    app.add_url_rule('/admin/profiles/download', 'download_profile', download_profile)
@@ -0,0 +1,38 @@
+import unittest
+
+from migrations import is_full_scan
+
+# Run from src with "python -m unittest".
+
+TABLES = {'courses', 'posts'}
+
+
+class FullScanTest(unittest.TestCase):
+
+    def test_current_plan_format(self):
+        self.assertTrue(is_full_scan('SCAN Courses', 'SELECT * FROM Courses', TABLES))
+        self.assertTrue(is_full_scan('SCAN p', 'SELECT * FROM Posts p', TABLES))
+        self.assertTrue(is_full_scan('SCAN Courses USING COVERING INDEX sqlite_autoindex_Courses_1',
+                                     'SELECT course_id FROM Courses', TABLES))
+        self.assertFalse(is_full_scan('SEARCH Courses USING INDEX sqlite_autoindex_Courses_1 (course_id=?)',
+                                      'SELECT * FROM Courses WHERE course_id = ?', TABLES))
+
+    # SQLite before 3.36, as in the Docker image, names the table after "SCAN TABLE".
+    def test_old_plan_format(self):
+        self.assertTrue(is_full_scan('SCAN TABLE Courses', 'SELECT * FROM Courses', TABLES))
+        self.assertTrue(is_full_scan('SCAN TABLE Posts AS p', 'SELECT * FROM Posts p', TABLES))
+        self.assertTrue(is_full_scan('SCAN TABLE Courses USING COVERING INDEX sqlite_autoindex_Courses_1',
+                                     'SELECT course_id FROM Courses', TABLES))
+        self.assertFalse(is_full_scan('SEARCH TABLE Courses USING INDEX sqlite_autoindex_Courses_1 (course_id=?)',
+                                      'SELECT * FROM Courses WHERE course_id = ?', TABLES))
+
+    def test_ignored_scans(self):
+        query = 'SELECT * FROM Courses_Search WHERE Courses_Search MATCH ?'
+        self.assertFalse(is_full_scan('SCAN Courses_Search VIRTUAL TABLE INDEX 0:M1', query, TABLES))
+        self.assertFalse(is_full_scan('SCAN TABLE Courses_Search VIRTUAL TABLE INDEX 0:M1', query, TABLES))
+        self.assertFalse(is_full_scan('SCAN SUBQUERY 1', 'SELECT * FROM (SELECT 1)', TABLES))
+        self.assertFalse(is_full_scan('USE TEMP B-TREE FOR ORDER BY', 'SELECT * FROM Courses', TABLES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+
+from flask import g
+from flask_login import current_user
+
+from cache import LRUCache, MISSING
+from catalog import get_catalog
+from database import get_connection
+
+# Loaded viewers are also kept across requests, since roles and teaching teams rarely change. Each is kept with the
+# user's version in User_Versions, which triggers bump on every write to their roles, enrollments or teams (see
+# migrations.py), and with the catalog's, since the courses taught come from Courses. A viewer is only used while both
+# still match, so a change made by any path or worker process is seen by the next request everywhere.
+viewer_cache = LRUCache(int(os.environ.get('NITTANYPATH_VIEWER_CACHE_SIZE', 10000)),
+                        int(os.environ.get('NITTANYPATH_VIEWER_CACHE_TTL', 300)))
+
+
+# Everything about a user that decides what they may see: whether they are a student or professor, which courses
+# they are enrolled in and in which section, and which courses they teach as a TA or professor.
+# It is loaded with one query the first time any of it is needed, and kept for the rest of the request.
+class Viewer:
+
+    def __init__(self, email):
+        self.email = email
+        self.loaded = False
+
+    # The versions are read before the viewer is queried, so a write landing in between leaves it under the older
+    # version, to be loaded again next time, rather than kept under the newer one without the write.
+    def load(self):
+        version = (user_version(self.email), get_catalog().version)
+        entry = viewer_cache.get(self.email)
+        if entry is MISSING or entry[0] != version:
+            entry = (version, self.query())
+            viewer_cache.set(self.email, entry)
+
+        self.user_type, self.sections, self.ta_team, self.ta_classes, self.prof_team, self.prof_classes = entry[1]
+        self.ta_courses = {course[0] for course in self.ta_classes}
+        self.prof_courses = {course[0] for course in self.prof_classes}
+        self.loaded = True
+
+    # Teaching courses come back as whole Courses rows, for the dashboard.
+    def query(self):
+        connection = get_connection()
+        cursor = connection.execute(
+            "SELECT 'student', NULL, NULL, NULL, NULL, NULL, NULL FROM Students WHERE email = :email "
+            "UNION ALL "
+            "SELECT 'professor', NULL, NULL, NULL, NULL, NULL, NULL FROM Professors WHERE email = :email "
+            "UNION ALL "
+            "SELECT 'enrolled', section_no, course_id, NULL, NULL, NULL, NULL FROM Enrolls "
+            "WHERE student_email = :email "
+            "UNION ALL "
+            "SELECT 'ta', t.teaching_team_id, c.* FROM TA_Teaching_Teams t "
+            "LEFT JOIN Courses c ON c.teaching_team_id = t.teaching_team_id WHERE t.student_email = :email "
+            "UNION ALL "
+            "SELECT 'prof', p.teaching_team_id, c.* FROM Prof_Teaching_Teams p "
+            "LEFT JOIN Courses c ON c.teaching_team_id = p.teaching_team_id WHERE p.prof_email = :email",
+            {'email': self.email})
+
+        kinds = set()
+        sections = {}
+        ta_team = None
+        ta_classes = []
+        prof_team = None
+        prof_classes = []
+
+        for kind, value, *course in cursor:
+            kinds.add(kind)
+            if kind == 'enrolled':
+                sections[course[0]] = value
+            elif kind == 'ta':
+                ta_team = value
+                if course[0] is not None:
+                    ta_classes.append(tuple(course))
+            elif kind == 'prof':
+                prof_team = value
+                if course[0] is not None:
+                    prof_classes.append(tuple(course))
+
+        if 'student' in kinds:
+            user_type = 'student'
+        elif 'professor' in kinds:
+            user_type = 'professor'
+        else:
+            user_type = None
+
+        return user_type, sections, ta_team, tuple(ta_classes), prof_team, tuple(prof_classes)
+
+    def __getattr__(self, name):
+        # only reached for attributes load() sets, the first time one of them is read.
+        if self.loaded or name.startswith('__'):
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+    def is_enrolled(self, course_id):
+        return course_id in self.sections
+
+    def section(self, course_id):
+        return self.sections.get(course_id)
+
+    def is_ta_for(self, course_id):
+        return course_id in self.ta_courses
+
+    def is_prof_for(self, course_id):
+        return course_id in self.prof_courses
+
+    # enrolled students, TAs and the professor of a course may read and write its posts.
+    def can_post(self, course_id):
+        return self.is_enrolled(course_id) or self.is_ta_for(course_id) or self.is_prof_for(course_id)
+
+
+# Returns the Viewer for email, by default the logged in user, creating it once per request.
+def get_viewer(email=None):
+    if email is None:
+        email = current_user.email
+
+    if 'viewers' not in g:
+        g.viewers = {}
+    if email not in g.viewers:
+        g.viewers[email] = Viewer(email)
+    return g.viewers[email]
+
+
+# Returns a user's version from User_Versions, reading it once per request.
+def user_version(email):
+    if 'user_versions' not in g:
+        g.user_versions = {}
+    if email not in g.user_versions:
+        cursor = get_connection().execute('SELECT version FROM User_Versions WHERE email = ?', (email,))
+        row = cursor.fetchone()
+        g.user_versions[email] = row[0] if row else 0
+    return g.user_versions[email]
+
+
+# Drops a user's Viewer after this request changed their enrollments or teams, so the rest of it sees the change.
+# Other requests see it anyway, from the user's version.
+def forget_viewer(email):
+    viewer_cache.invalidate(email)
+    if 'viewers' in g:
+        g.viewers.pop(email, None)
+    if 'user_versions' in g:
+        g.user_versions.pop(email, None)